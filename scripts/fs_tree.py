@@ -1,160 +1,1560 @@
 #!/usr/bin/env python3
 # coding: utf-8
-import os, sys, argparse, json, fnmatch
+import os, re, sys, time, argparse, bisect, json, fnmatch, functools, hashlib, heapq, threading, contextlib
+from array import array
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field, fields
 from pathlib import Path
+from typing import List, Optional
 
-def load_gitignore(root: Path):
-    patterns = []
-    gi = root / ".gitignore"
-    if gi.exists():
-        for line in gi.read_text(encoding="utf-8", errors="ignore").splitlines():
-            line = line.strip()
+_GLOB_CHARS = frozenset("*?[\\")
+
+def load_gitignore(path):
+    try:
+        with open(path, encoding="utf-8", errors="ignore") as f:
+            return f.read()
+    except OSError:
+        return ""
+
+def _translate_glob(pat: str):
+    # gitignore 形式のグロブ → 正規表現（* と ? は / をまたがない、** は階層をまたぐ）
+    out, i, n = [], 0, len(pat)
+    while i < n:
+        c = pat[i]
+        if c == "*":
+            j = i
+            while j < n and pat[j] == "*":
+                j += 1
+            if j - i >= 2 and (i == 0 or pat[i - 1] == "/") and (j == n or pat[j] == "/"):
+                if j == n:
+                    out.append(".*")
+                else:
+                    out.append("(?:.*/)?")
+                    j += 1
+            else:
+                out.append("[^/]*")
+            i = j
+            continue
+        if c == "?":
+            out.append("[^/]")
+        elif c == "[":
+            j = i + 1
+            if j < n and pat[j] in "!^":
+                j += 1
+            if j < n and pat[j] == "]":
+                j += 1
+            while j < n and pat[j] != "]":
+                j += 1
+            if j >= n:
+                out.append(re.escape(c))
+            else:
+                body = pat[i + 1:j]
+                cls = ["^"] if body[:1] in ("!", "^") else []
+                k = len(cls)
+                while k < len(body):
+                    ch = body[k]
+                    if ch == "\\" and k + 1 < len(body):
+                        k += 1
+                        ch = body[k]
+                        cls.append(re.escape(ch))
+                    else:
+                        cls.append("-" if ch == "-" else re.escape(ch))
+                    k += 1
+                out.append("[" + "".join(cls) + "]")
+                i = j + 1
+                continue
+        elif c == "\\" and i + 1 < n:
+            i += 1
+            out.append(re.escape(pat[i]))
+        else:
+            out.append(re.escape(c))
+        i += 1
+    return "".join(out)
+
+class IgnoreRules:
+    # 1つの .gitignore をコンパイルしたもの。リテラル名・拡張子・アンカー付きパスは dict、
+    # 残りは逆順に並べた1本の正規表現にまとめ、「最後にマッチした規則が勝つ」を max(index) で判定する
+    def __init__(self, text: str):
+        self.rules = []  # (pattern, negate, dir_only)
+        # [0] はファイル用（ディレクトリ専用規則を除く）、[1] はディレクトリ用
+        self._names = ({}, {})
+        self._exts = ({}, {})
+        self._paths = ({}, {})
+        regex = ([], [])
+        for raw in text.splitlines():
+            line = raw.rstrip("\r")
+            while line.endswith(" ") and not line.endswith("\\ "):
+                line = line[:-1]
             if not line or line.startswith("#"):
                 continue
-            patterns.append(line)
-    return patterns
-
-def should_ignore(name: str, relpath: str, patterns, extra_ignores, show_hidden):
-    if not show_hidden and name.startswith("."):
-        return True
-    for p in extra_ignores:
-        if fnmatch.fnmatch(name, p) or fnmatch.fnmatch(relpath, p):
+            negate = line.startswith("!")
+            if negate:
+                line = line[1:]
+            dir_only = line.endswith("/")
+            line = line.rstrip("/")
+            anchored = "/" in line
+            if line.startswith("/"):
+                line = line[1:]
+            if not line:
+                continue
+            idx = len(self.rules)
+            self.rules.append((raw.strip(), negate, dir_only))
+            kinds = (1,) if dir_only else (0, 1)
+            plain = not (_GLOB_CHARS & set(line))
+            tail = line[2:]
+            if plain and not anchored:
+                buckets = self._names
+                key = line
+            elif not anchored and line.startswith("*.") and tail and not (_GLOB_CHARS & set(tail)) and "." not in tail:
+                buckets = self._exts
+                key = tail
+            elif plain:
+                buckets = self._paths
+                key = line
+            else:
+                rx = _translate_glob(line)
+                for k in kinds:
+                    regex[k].append((idx, rx if anchored else "(?:.*/)?" + rx))
+                continue
+            for k in kinds:
+                buckets[k][key] = idx
+        self._rx = []
+        self._rx_rule = []
+        for k in (0, 1):
+            parts = regex[k][::-1]
+            self._rx.append(re.compile("|".join(f"({rx})" for _, rx in parts), re.S) if parts else None)
+            self._rx_rule.append([None] + [idx for idx, _ in parts])
+
+    def match(self, sub: str, name: str, is_dir: bool):
+        # sub: この .gitignore のあるディレクトリからの相対パス。マッチした規則の index（なければ -1）
+        k = 1 if is_dir else 0
+        best = self._names[k].get(name, -1)
+        if "." in name:
+            best = max(best, self._exts[k].get(name.rpartition(".")[2], -1))
+        best = max(best, self._paths[k].get(sub, -1))
+        rx = self._rx[k]
+        if rx is not None and self._rx_rule[k][1] > best:
+            m = rx.fullmatch(sub)
+            if m:
+                best = max(best, self._rx_rule[k][m.lastindex])
+        return best
+
+class IgnoreMatcher:
+    # --ignore グロブと .gitignore 群をまとめた再利用可能なマッチャー。
+    # frames は (ベースの相対パス, IgnoreRules) のタプルで、walk が降りるたびに積む
+    def __init__(self, ignores=(), show_hidden=False, use_gitignore=True):
+        self.show_hidden = show_hidden
+        self.use_gitignore = use_gitignore
+        self.ignores = tuple(ignores)
+        self._extra = re.compile("|".join(fnmatch.translate(p) for p in ignores)) if ignores else None
+        self._compiled = {}
+        # --stats: 除外が決まるたびに on_hit(出どころ, パターン) を呼ぶ（None なら何もしない）
+        self.on_hit = None
+
+    def compile(self, text: str):
+        rules = self._compiled.get(text)
+        if rules is None:
+            rules = self._compiled[text] = IgnoreRules(text)
+        return rules
+
+    def root_frames(self, root: Path):
+        if not self.use_gitignore:
+            return ()
+        text = load_gitignore(os.path.join(root, ".git", "info", "exclude"))
+        return (("", self.compile(text)),) if text else ()
+
+    def descend(self, frames, rel: str, gitignore_path: str):
+        if not self.use_gitignore:
+            return frames
+        text = load_gitignore(gitignore_path)
+        return frames + ((rel, self.compile(text)),) if text else frames
+
+    def _which_ignore(self, name: str, relpath: str):
+        # 合成した正規表現からはどの --ignore が当たったか分からないので、--stats のときだけ個別に照合し直す
+        for p in self.ignores:
+            if fnmatch.fnmatchcase(name, p) or fnmatch.fnmatchcase(relpath, p):
+                return p
+        return "?"
+
+    def ignored(self, frames, name: str, relpath: str, is_dir: bool):
+        if not self.show_hidden and name.startswith("."):
+            if self.on_hit is not None:
+                self.on_hit("hidden", ".*")
             return True
-    for p in patterns:
-        tgt = relpath if p.startswith("/") else name
-        patt = p.lstrip("/")
-        if fnmatch.fnmatch(tgt, patt) or fnmatch.fnmatch(relpath, patt):
+        if self._extra is not None and (self._extra.match(name) or self._extra.match(relpath)):
+            if self.on_hit is not None:
+                self.on_hit("--ignore", self._which_ignore(name, relpath))
             return True
-    return False
+        for base, rules in reversed(frames):
+            sub = relpath[len(base) + 1:] if base else relpath
+            idx = rules.match(sub, name, is_dir)
+            if idx >= 0:
+                pat, negate, _ = rules.rules[idx]
+                if self.on_hit is not None:
+                    self.on_hit(base + "/.gitignore" if base else ".gitignore", pat)
+                return not negate
+        return False
 
-def list_dir(root: Path, max_depth, ignores, show_hidden, dirs_only, files_only, limit_per_dir, follow_symlinks):
-    gitignore_patterns = load_gitignore(root)
+class _IncludeNode:
+    __slots__ = ("lit", "globs", "star", "loop", "end", "dir_end")
 
-    def walk(cur: Path, depth: int, prefix_parts):
-        rel = str(cur.relative_to(root)) if cur != root else ""
-        try:
-            entries = sorted(cur.iterdir(), key=lambda p: (p.is_file(), p.name.lower()))
-        except PermissionError:
-            yield ("perm", cur, prefix_parts, False)
-            return
-        truncated = False
-        if limit_per_dir and len(entries) > limit_per_dir:
-            entries = entries[:limit_per_dir]
-            truncated = True
-
-        show_list = []
-        for e in entries:
-            relp = (rel + ("/" if rel else "")) + e.name
-            if should_ignore(e.name, relp, gitignore_patterns, ignores, show_hidden):
+    def __init__(self, loop=False):
+        self.lit = {}  # 段の名前 -> 節点
+        self.globs = []  # (段の正規表現, 節点)
+        self.star = None  # 「**」の節点（0 段以上を読み飛ばす）
+        self.loop = loop
+        self.end = False
+        self.dir_end = False  # 末尾が / のパターン（ディレクトリだけにマッチ）
+
+class IncludeTrie:
+    # --include グロブを / 区切りの段ごとのトライにまとめたもの。walk はディレクトリごとに「途中まで一致した節点」の
+    # 組を持ち回り、どの節点からも先がない子ディレクトリは一覧しない。マッチしたディレクトリは配下をすべて含める。
+    # / を含まないパターンは .gitignore と同じくどの階層の名前にもマッチする
+    def __init__(self, patterns):
+        self.root = _IncludeNode()
+        for pat in patterns:
+            dir_only = pat.endswith("/")
+            pat = pat.strip("/") if "/" in pat.rstrip("/") else "**/" + pat.rstrip("/")
+            node = self.root
+            for seg in pat.split("/"):
+                if seg == "**":
+                    if not node.loop:
+                        if node.star is None:
+                            node.star = _IncludeNode(loop=True)
+                        node = node.star
+                elif not (_GLOB_CHARS & set(seg)):
+                    node = node.lit.setdefault(seg, _IncludeNode())
+                else:
+                    rx = _translate_glob(seg)
+                    nxt = next((c for r, c in node.globs if r.pattern == rx), None)
+                    if nxt is None:
+                        nxt = _IncludeNode()
+                        node.globs.append((re.compile(rx, re.S), nxt))
+                    node = nxt
+            if dir_only:
+                node.dir_end = True
+            else:
+                node.end = True
+
+    @staticmethod
+    def _closure(nodes):
+        out = []
+        for n in nodes:
+            while n is not None and n not in out:
+                out.append(n)
+                n = n.star
+        return tuple(out)
+
+    def start(self):
+        return self._closure((self.root,))
+
+    def step(self, state, name: str, is_dir: bool):
+        # 子 name の状態: None ならマッチ（配下は無条件で含める）、空でないタプルなら祖先として残す、() なら除外
+        nxt = []
+        for n in state:
+            if n.loop:
+                nxt.append(n)
+            c = n.lit.get(name)
+            if c is not None:
+                nxt.append(c)
+            for rx, c in n.globs:
+                if rx.fullmatch(name):
+                    nxt.append(c)
+        nxt = self._closure(nxt)
+        for c in nxt:
+            if c.end or (is_dir and c.dir_end):
+                return None
+        return nxt if is_dir else ()
+
+Entry = namedtuple("Entry", "name path is_dir is_file is_symlink link stat total files lines language dupe series digest", defaults=(None,) * 7)
+Stat = namedtuple("Stat", "st_size st_mtime_ns")
+
+# --series の既定パターン。名前付きグループ v がバージョン部分で、そこを * にした名前がグループのラベルになる
+DEFAULT_SERIES = (
+    r"\.(?:bak|backup|orig|old|save)\.(?P<v>\d+)$",  # layout.tsx.bak.1758419088
+    r"\.(?:bak|backup|orig|old)\.(?P<v>\d+)\.\w+$",  # parseLawXml.backup.1757751382.ts
+    r"[._-](?P<v>\d{8}[_-]?\d{4,6}|\d{10,13})(?:\.\w+)?$",  # report_20250920_010043.csv, dump.1758419088
+)
+
+def series_regex(pat: str):
+    # argparse の type: 名前付きグループ v を持つ正規表現だけ受け付ける
+    try:
+        rx = re.compile(pat)
+    except re.error as ex:
+        raise argparse.ArgumentTypeError(f"bad regex {pat!r}: {ex}")
+    if "v" not in rx.groupindex:
+        raise argparse.ArgumentTypeError(f"regex needs a (?P<v>...) group: {pat!r}")
+    return pat
+
+def _version_key(v: str):
+    return [int(x) for x in re.findall(r"\d+", v)] or [v]
+
+class SeriesGrouper:
+    # 兄弟のファイルのうち、バージョン部分だけが違うもの（タイムスタンプ付きバックアップ等）を1つのエントリにまとめる。
+    # まとめたエントリの series はメンバー名を古い順に並べたタプルで、stat は合計サイズと最新の mtime
+    def __init__(self, patterns):
+        self.rx = [re.compile(p) for p in patterns]
+
+    def group(self, entries, want_stat=False):
+        # (まとめた後のエントリ, 各エントリの元の添字)。グループは最初のメンバーの位置に置く
+        found = {}
+        for k, e in enumerate(entries):
+            if not e.is_file or e.is_symlink:
                 continue
-            if dirs_only and not e.is_dir():
+            for rx in self.rx:
+                m = rx.search(e.name)
+                if m is not None and m.group("v"):
+                    label = e.name[:m.start("v")] + "*" + e.name[m.end("v"):]
+                    found.setdefault(label, []).append((_version_key(m.group("v")), k))
+                    break
+        first = {}
+        skip = set()
+        for label, members in found.items():
+            if len(members) < 2:
                 continue
-            if files_only and not e.is_file():
+            ks = [k for _, k in members]
+            first[min(ks)] = label, [entries[k] for _, k in sorted(members)]
+            skip.update(ks)
+        if not first:
+            return entries, range(len(entries))
+        out, keep = [], []
+        for k, e in enumerate(entries):
+            if k in first:
+                label, ms = first[k]
+                st = None
+                if want_stat:
+                    sts = [m.stat for m in ms if m.stat is not None]
+                    st = Stat(sum(s.st_size for s in sts), max((s.st_mtime_ns for s in sts), default=0))
+                e = Entry(label, os.path.join(os.path.dirname(e.path), label), False, True, False, None, st,
+                          series=tuple(m.name for m in ms))
+            elif k in skip:
                 continue
-            show_list.append(e)
+            out.append(e)
+            keep.append(k)
+        return out, keep
 
-        for i, e in enumerate(show_list):
-            is_last = (i == len(show_list) - 1)
-            yield ("node", e, prefix_parts + [is_last], truncated and is_last)
-            if e.is_dir():
-                if max_depth is None or depth < max_depth:
-                    if e.is_symlink() and not follow_symlinks:
+def _dirent_kind(de):
+    # (is_dir, is_file)。シンボリックリンクは参照先で判定する
+    try:
+        is_dir = de.is_dir()
+        return is_dir, not is_dir and de.is_file()
+    except OSError:
+        return False, False
+
+def make_entry(de, want_stat=False):
+    # DirEntry のキャッシュ（d_type）を使うので、通常のエントリは追加の stat 不要
+    is_symlink = de.is_symlink()
+    is_dir, is_file = _dirent_kind(de)
+    link = None
+    if is_symlink:
+        try:
+            link = os.readlink(de.path)
+        except OSError:
+            link = "?"
+    st = None
+    if want_stat:
+        try:
+            st = de.stat(follow_symlinks=False)
+        except OSError:
+            pass
+    return Entry(de.name, de.path, is_dir, is_file, is_symlink, link, st)
+
+def root_entry(root: Path):
+    return Entry(root.name, str(root), True, False, False, None, None)
+
+def scan_dir(path: str, want_stat=False, stat_pool=None):
+    with os.scandir(path) as it:
+        if want_stat and stat_pool is not None:
+            des = list(it)
+            if len(des) > 16:
+                # 高レイテンシな FS では lstat をスレッドプールで並列に発行する
+                return list(stat_pool.map(functools.partial(make_entry, want_stat=True), des))
+            return [make_entry(de, True) for de in des]
+        return [make_entry(de, want_stat) for de in it]
+
+def _restat(e: Entry):
+    try:
+        return e._replace(stat=os.lstat(e.path))
+    except OSError:
+        return e
+
+def save_json(file: str, obj):
+    # 一時ファイルに書いてから置き換える。UTF-8 にならないファイル名（surrogateescape された名前）もそのまま往復させ、
+    # 失敗したら一時ファイルを残さない
+    os.makedirs(os.path.dirname(file), exist_ok=True)
+    tmp = f"{file}.{os.getpid()}.tmp"
+    try:
+        with open(tmp, "w", encoding="utf-8", errors="surrogateescape") as f:
+            json.dump(obj, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp, file)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.unlink(tmp)
+        raise
+
+def load_json(file: str):
+    with open(file, encoding="utf-8", errors="surrogateescape") as f:
+        return json.load(f)
+
+class ListingCache:
+    # ディレクトリ一覧のディスクキャッシュ。キーはパスと (st_mtime_ns, st_ino)。
+    # 一覧はフィルタ前の生データで持つので、ignore 規則や CLI フラグは毎回キャッシュの後段で適用される
+    VERSION = 1
+
+    def __init__(self, file: str, root: str):
+        self.file = file
+        self.root = root
+        self.dirs = {}
+        self.fresh = {}  # 今回訪れたディレクトリ: path -> (mtime_ns, ino, raw, hit)
+        try:
+            data = load_json(file)
+            if data.get("version") == self.VERSION and data.get("root") == root:
+                self.dirs = data["dirs"]
+        except (OSError, ValueError, KeyError):
+            pass
+
+    @staticmethod
+    def default_file(root: str, cache_dir=None):
+        if cache_dir is None:
+            base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+            cache_dir = os.path.join(base, "fs_tree")
+        return os.path.join(cache_dir, hashlib.sha1(os.fsencode(root)).hexdigest()[:16] + ".json")
+
+    def scan(self, path: str, want_stat=False, stat_pool=None):
+        st = os.stat(path)
+        rec = self.dirs.get(path)
+        if rec is not None and rec[0] == st.st_mtime_ns and rec[1] == st.st_ino:
+            raw = rec[2]
+            entries = [Entry(name, os.path.join(path, name), bool(bits & 1), bool(bits & 2), bool(bits & 4), link, None)
+                       for name, bits, link in raw]
+            if want_stat:
+                # サイズや mtime はディレクトリの mtime では検知できないので、一覧だけ再利用して lstat し直す
+                entries = list((stat_pool.map if stat_pool is not None else map)(_restat, entries))
+            self.fresh[path] = (st.st_mtime_ns, st.st_ino, raw, True)
+            return entries
+        entries = scan_dir(path, want_stat, stat_pool)
+        raw = [[e.name, e.is_dir | e.is_file << 1 | e.is_symlink << 2, e.link] for e in entries]
+        self.fresh[path] = (st.st_mtime_ns, st.st_ino, raw, False)
+        return entries
+
+    @property
+    def hits(self):
+        return sum(1 for v in self.fresh.values() if v[3])
+
+    @property
+    def misses(self):
+        return len(self.fresh) - self.hits
+
+    def save(self):
+        dirs = dict(self.dirs)
+        gone = []
+        for path, (mtime, ino, raw, hit) in self.fresh.items():
+            old = dirs.get(path)
+            if not hit and old is not None:
+                names = {r[0] for r in raw}
+                gone += [os.path.join(path, r[0]) + os.sep for r in old[2] if r[1] & 1 and r[0] not in names]
+            dirs[path] = [mtime, ino, raw]
+        if gone:
+            # 消えたディレクトリ配下の古い一覧は捨てる
+            prefixes = tuple(gone)
+            dirs = {k: v for k, v in dirs.items() if not (k + os.sep).startswith(prefixes)}
+        save_json(self.file, {"version": self.VERSION, "root": self.root, "dirs": dirs})
+
+def list_dir(root: Path, max_depth, ignores, show_hidden, dirs_only, files_only, limit_per_dir, follow_symlinks, want_stat=False, matcher=None, jobs=1, cache=None, stat_jobs=1, stats=None, includes=(), series=(), start=None, on_dir=None):
+    # start: (エントリ, 深さ, frames, --include 状態) から walk する（root は相対パスの基準のまま）。
+    # on_dir(エントリ, 深さ, frames, 状態): ディレクトリを一覧する前に呼び、False なら配下を出さない（--watch が使う）
+    if matcher is None:
+        matcher = IgnoreMatcher(ignores, show_hidden)
+    trie = IncludeTrie(includes) if includes else None
+    grouper = SeriesGrouper(series) if series else None
+    scanner = cache.scan if cache is not None else scan_dir
+    root_path = str(root)
+    base = len(os.path.join(root_path, ""))
+    sort_key = lambda e: (e.is_file, e.name.lower())
+    heap_scan = bool(limit_per_dir and cache is None and grouper is None)
+    # --include: 候補のディレクトリ（祖先としてだけ一致したもの）は、配下に実際のマッチがある場合だけ出す。
+    # nonempty はその判定の結果、looked は判定のために一覧した生のエントリ（表示するときに scandir し直さない）
+    nonempty = {}
+    looked = {}
+
+    def raw_entries(path: str):
+        entries = looked.pop(path, None)
+        if entries is None:
+            entries = sorted(scanner(path, want_stat, stat_pool), key=sort_key)
+        return entries
+
+    def has_match(e: Entry, rel: str, depth: int, frames, state):
+        # 候補ディレクトリ e の配下に --include のマッチがあるか。最初の1件で打ち切るので、出力を待たせるのは
+        # 最初のマッチまでの先読みだけ（マッチのない部分木は1回たどって捨てる）
+        found = nonempty.get(e.path)
+        if found is not None:
+            return found
+        try:
+            entries = raw_entries(e.path)
+        except OSError:
+            entries = []
+        if any(c.name == ".gitignore" and c.is_file for c in entries):
+            frames = matcher.descend(frames, rel, os.path.join(e.path, ".gitignore"))
+        found = False
+        for c in entries:
+            relp = rel + "/" + c.name
+            if matcher.ignored(frames, c.name, relp, c.is_dir) or (dirs_only and not c.is_dir) or (files_only and not c.is_file):
+                continue
+            sub = trie.step(state, c.name, c.is_dir)
+            if sub is None or (sub and descends(c, depth) and has_match(c, relp, depth + 1, frames, sub)):
+                found = True
+                break
+        nonempty[e.path] = found
+        if found and not heap_scan:
+            looked[e.path] = entries
+        return found
+
+    def scan_top(cur: Entry, rel: str, depth: int, frames, state):
+        # --limit-per-dir: scandir のストリームを絞り込みながら、並び順で先頭の limit 件だけをヒープに残す。
+        # 全件の sort も Entry 化（readlink / lstat）もしないので、巨大なディレクトリでもメモリは O(limit)
+        frames = matcher.descend(frames, rel, os.path.join(cur.path, ".gitignore"))
+        prefix = rel + "/" if rel else ""
+        counts = [0, 0]  # 走査した数, 絞り込みを通った数
+
+        def candidates(it):
+            for de in it:
+                counts[0] += 1
+                is_dir, is_file = _dirent_kind(de)
+                if matcher.ignored(frames, de.name, prefix + de.name, is_dir):
+                    continue
+                if (dirs_only and not is_dir) or (files_only and not is_file):
+                    continue
+                sub = None
+                if state is not None:
+                    sub = trie.step(state, de.name, is_dir)
+                    if sub == ():
                         continue
-                    yield from walk(e, depth + 1, prefix_parts + [is_last])
+                    if sub:
+                        e = make_entry(de)
+                        if not (descends(e, depth) and has_match(e, prefix + de.name, depth + 1, frames, sub)):
+                            continue
+                counts[1] += 1
+                yield (is_file, de.name.lower()), de, sub
 
-    yield from walk(root, 1, [])
+        with os.scandir(cur.path) as it:
+            top = heapq.nsmallest(limit_per_dir, candidates(it), key=lambda c: c[0])
+        des = [c[1] for c in top]
+        mk = functools.partial(make_entry, want_stat=want_stat)
+        show_list = list(stat_pool.map(mk, des)) if stat_pool is not None and len(des) > 16 else [mk(de) for de in des]
+        states = [c[2] for c in top] if state is not None else None
+        return show_list, counts[1] - len(show_list), frames, states, counts[0]
 
-def visual_prefix(prefix_flags):
-    if not prefix_flags:
-        return ""
-    s = ""
-    for is_last in prefix_flags[:-1]:
-        s += "    " if is_last else "│   "
-    s += "└── " if prefix_flags[-1] else "├── "
-    return s
+    def scan(cur: Entry, rel: str, depth: int, frames, state):
+        # (表示するエントリ, 上限で省いた件数, 子に渡す frames, 各エントリの --include 状態（なければ None）)
+        t0 = time.perf_counter() if stats is not None else 0.0
+        states = None
+        if heap_scan:
+            show_list, more, frames, states, listed = scan_top(cur, rel, depth, frames, state)
+            entries = show_list
+        else:
+            entries = raw_entries(cur.path)
+            listed = len(entries)
+            for e in entries:
+                if e.name == ".gitignore" and e.is_file:
+                    frames = matcher.descend(frames, rel, e.path)
+                    break
 
-def to_text(root: Path, items):
-    lines = [str(root.name) + "/"]
-    for kind, path, pre, truncated_flag in items:
+            show_list = []
+            if state is not None:
+                states = []
+            for e in entries:
+                relp = (rel + ("/" if rel else "")) + e.name
+                if matcher.ignored(frames, e.name, relp, e.is_dir):
+                    continue
+                if dirs_only and not e.is_dir:
+                    continue
+                if files_only and not e.is_file:
+                    continue
+                if state is not None:
+                    sub = trie.step(state, e.name, e.is_dir)
+                    if sub == () or (sub and not (descends(e, depth) and has_match(e, relp, depth + 1, frames, sub))):
+                        continue
+                    states.append(sub)
+                show_list.append(e)
+            if grouper is not None:
+                show_list, keep = grouper.group(show_list, want_stat)
+                if states is not None:
+                    states = [states[k] for k in keep]
+            more = 0
+            if limit_per_dir and len(show_list) > limit_per_dir:
+                more = len(show_list) - limit_per_dir
+                del show_list[limit_per_dir:]
+        if stats is not None:
+            stats.listing(cur.path, t0, time.perf_counter(), listed, len(show_list), entries, want_stat, cache)
+        return show_list, more, frames, states
+
+    def descends(e: Entry, depth: int):
+        if not e.is_dir or (max_depth is not None and depth >= max_depth):
+            return False
+        return follow_symlinks or not e.is_symlink
+
+    # --jobs: 子ディレクトリの scandir をスレッドプールで先読みする。
+    # 出力順は下の直列 walk がそのまま決めるので、結果はシリアル版と同一
+    pool = ThreadPoolExecutor(max_workers=jobs) if jobs and jobs > 1 else None
+    stat_pool = ThreadPoolExecutor(max_workers=stat_jobs) if want_stat and stat_jobs and stat_jobs > 1 else None
+    pending = {}
+    max_pending = (jobs or 1) * 64
+
+    def listing(cur: Entry, rel: str, depth: int, frames, state):
+        fut = pending.pop(cur.path, None)
+        res = fut.result() if fut is not None else scan(cur, rel, depth, frames, state)
+        if pool is not None:
+            show_list, _, child_frames, states = res
+            for i, e in enumerate(show_list):
+                if len(pending) >= max_pending:
+                    break
+                if descends(e, depth):
+                    relp = (rel + ("/" if rel else "")) + e.name
+                    pending[e.path] = pool.submit(scan, e, relp, depth + 1, child_frames, states[i] if states is not None else None)
+        return res
+
+    def walk(cur: Entry, depth: int, cur_last: bool, frames, state):
+        # item は (種別, エントリ, 深さ, 兄弟の最後か, 省いた件数)。祖先の情報は持ち回らない（罫線は renderer が深さごとに持つ）
+        if on_dir is not None and not on_dir(cur, depth, frames, state):
+            return
+        rel = cur.path[base:] if cur.path != root_path else ""
+        try:
+            show_list, more, frames, states = listing(cur, rel, depth, frames, state)
+        except PermissionError:
+            yield ("perm", cur, depth - 1, cur_last, 0)
+            return
+
+        last = len(show_list) - 1
+        for i, e in enumerate(show_list):
+            is_last = i == last
+            yield ("node", e, depth, is_last, more if is_last else 0)
+            if descends(e, depth):
+                yield from walk(e, depth + 1, is_last, frames, states[i] if states is not None else None)
+
+    if start is None:
+        start = (root_entry(root), 1, matcher.root_frames(root), trie.start() if trie is not None else None)
+    try:
+        cur, depth, frames, state = start
+        yield from walk(cur, depth, True, frames, state)
+    finally:
+        for p in (pool, stat_pool):
+            if p is not None:
+                p.shutdown(wait=False, cancel_futures=True)
+
+def human_size(n: int):
+    for unit in ("B", "K", "M", "G", "T"):
+        if n < 1024 or unit == "T":
+            return f"{n}{unit}" if unit == "B" else f"{n:.1f}{unit}"
+        n /= 1024
+
+def series_span(e: Entry):
+    # まとめたエントリの (件数, 最古, 最新) のバージョン部分（ラベルの * に当たる所）
+    head, _, tail = e.name.partition("*")
+    ver = [m[len(head):len(m) - len(tail)] for m in (e.series[0], e.series[-1])]
+    return len(e.series), ver[0], ver[1]
+
+def text_meta(e: Entry, cols):
+    # --size / --mtime / --rollup の列と、--series でまとめた件数（なければ空文字）
+    parts = []
+    if e.series is not None:
+        n, oldest, newest = series_span(e)
+        parts.append(f"{n} versions: {oldest} … {newest}")
+    if e.total is not None and "rollup" in cols:
+        parts.append(f"{human_size(e.total)} in {e.files} files")
+    elif e.stat is not None and "size" in cols and not e.is_dir:
+        parts.append(human_size(e.stat.st_size))
+    if e.stat is not None and "mtime" in cols:
+        parts.append(time.strftime("%Y-%m-%d %H:%M", time.localtime(e.stat.st_mtime_ns / 1e9)))
+    if e.lines is not None and "loc" in cols:
+        s = f"{e.lines:,} line" + ("" if e.lines == 1 else "s")
+        if e.is_dir and e.lines:
+            # 内訳は上位 3 言語まで
+            top = [f"{k} {v * 100 // e.lines}%" for k, v in list(e.language.items())[:3]]
+            s += " (" + ", ".join(top) + (", …" if len(e.language) > 3 else "") + ")"
+        parts.append(s)
+    if e.dupe is not None and "dupes" in cols:
+        parts.append(f"dup #{e.dupe + 1}")
+    if e.digest is not None and "merkle" in cols:
+        parts.append("#" + e.digest[:12])
+    return "  [" + ", ".join(parts) + "]" if parts else ""
+
+def iter_text(header: str, items, cols=()):
+    yield header
+    # stems[d] は深さ d の行の枝（├── / └──）の手前までの罫線。ディレクトリの行で配下の分を1度だけ作り、
+    # 兄弟の行は使い回すので、1行あたりの仕事は深さによらない（行そのものの組み立ては f-string 1回）
+    stems = ["", ""]
+    pending = []  # 「… N more」は最後の兄弟（の配下）を出し終えてから、兄弟と同じ罫線の行として出す: (深さ, 行)
+    for kind, e, depth, is_last, more in items:
+        while pending and pending[-1][0] >= depth + (kind == "perm"):
+            yield pending.pop()[1]
+        branch = ("└── " if is_last else "├── ") if depth else ""
         if kind == "perm":
-            lines.append(f"{visual_prefix(pre)}[permission denied]")
+            yield f"{stems[depth]}{branch}[permission denied]"
             continue
-        name = path.name + ("/" if path.is_dir() else "")
-        if path.is_symlink():
+        name = e.name + ("/" if e.is_dir else "")
+        if e.is_symlink:
+            name += f" -> {e.link}"
+        if cols or e.series is not None:
+            name += text_meta(e, cols)
+        yield f"{stems[depth]}{branch}{name}"
+        if e.is_dir:
+            stem = stems[depth] + ("    " if is_last else "│   ")
+            if len(stems) == depth + 1:
+                stems.append(stem)
+            else:
+                stems[depth + 1] = stem
+        if more:
+            pending.append((depth, f"{stems[depth]}… {more} more"))
+    while pending:
+        yield pending.pop()[1]
+
+def to_text(root: Path, items):
+    return "\n".join(iter_text(str(root.name) + "/", items))
+
+def write_stream(chunks, out, sep="", flush_interval=0.2):
+    # 断片をバッファ付きで書き出し、一定間隔で flush（| head やページャがすぐ反応する）
+    last = time.monotonic()
+    for chunk in chunks:
+        out.write(chunk)
+        out.write(sep)
+        now = time.monotonic()
+        if now - last >= flush_interval:
+            out.flush()
+            last = now
+    out.flush()
+
+def write_text(header: str, items, out, cols=()):
+    write_stream(iter_text(header, items, cols), out, sep="\n")
+
+class Stats:
+    # --stats の集計。無効時は各所に None を渡すので、ホットパスに残るのは
+    # ディレクトリごと・除外ごとの None 判定だけになる。--jobs のスレッドからも呼ばれるのでロックを取る
+    def __init__(self, top=10, trace=False):
+        self.start = time.perf_counter()
+        self.top = top
+        self.phases = {}
+        self.dirs = self.entries = self.shown = 0
+        self.syscalls = dict.fromkeys(("scandir", "stat", "lstat", "readlink"), 0)
+        self.rule_hits = {}
+        self.slow = []  # (秒, path) の min-heap（上位 top 件だけ残す）
+        self.events = [] if trace else None
+        self.profile = None  # --stats-dump *.prof のときの cProfile.Profile
+        self._pulled = 0.0
+        self._lock = threading.Lock()
+
+    def _add_phase(self, name, t0, dt):
+        self.phases[name] = self.phases.get(name, 0.0) + dt
+        if self.events is not None:
+            self.events.append({"name": name, "cat": "phase", "ph": "X", "pid": os.getpid(), "tid": 0,
+                                "ts": round((t0 - self.start) * 1e6), "dur": round(dt * 1e6)})
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        # 中で pull() が引き出した時間は除く（ストリーム出力では walk と描画が交互に進むため）
+        t0, pulled = time.perf_counter(), self._pulled
+        try:
+            yield
+        finally:
+            self._add_phase(name, t0, time.perf_counter() - t0 - (self._pulled - pulled))
+
+    def pull(self, name, items):
+        # items の next() にかかった時間だけを name に積む
+        it, total, clock = iter(items), 0.0, time.perf_counter
+        t_first = clock()
+        try:
+            while True:
+                t0 = clock()
+                try:
+                    item = next(it)
+                except StopIteration:
+                    break
+                finally:
+                    dt = clock() - t0
+                    total += dt
+                    self._pulled += dt
+                yield item
+        finally:
+            self._add_phase(name, t_first, total)
+
+    def listing(self, path, t0, t1, listed, shown, entries, want_stat, cache):
+        # 発行したシステムコールは一覧の出どころから数える（ListingCache のヒットは scandir なし）
+        fresh = getattr(cache, "fresh", None)
+        hit = fresh is not None and fresh.get(path, (0, 0, 0, False))[3]
+        with self._lock:
+            self.dirs += 1
+            self.entries += listed
+            self.shown += shown
+            if not getattr(cache, "virtual", False):  # --git-index の一覧は索引から作るので数えない
+                c = self.syscalls
+                c["stat"] += fresh is not None
+                c["scandir"] += not hit
+                c["lstat"] += len(entries) if want_stat else 0
+                c["readlink"] += 0 if hit else sum(1 for e in entries if e.is_symlink)
+            if len(self.slow) < self.top:
+                heapq.heappush(self.slow, (t1 - t0, path))
+            elif t1 - t0 > self.slow[0][0]:
+                heapq.heapreplace(self.slow, (t1 - t0, path))
+            if self.events is not None:
+                self.events.append({"name": path, "cat": "dir", "ph": "X", "pid": os.getpid(), "tid": threading.get_ident(),
+                                    "ts": round((t0 - self.start) * 1e6), "dur": round((t1 - t0) * 1e6),
+                                    "args": {"entries": listed, "shown": shown}})
+
+    def rule_hit(self, source, pattern):
+        key = (source, pattern)
+        with self._lock:
+            self.rule_hits[key] = self.rule_hits.get(key, 0) + 1
+
+    def summary(self):
+        return {
+            "total_ms": round((time.perf_counter() - self.start) * 1000, 3),
+            "phases_ms": {k: round(v * 1000, 3) for k, v in self.phases.items()},
+            "dirs": self.dirs,
+            "entries": self.entries,
+            "shown": self.shown,
+            "syscalls": self.syscalls,
+            "rule_hits": [{"source": s, "pattern": p, "hits": n} for (s, p), n in
+                          sorted(self.rule_hits.items(), key=lambda kv: -kv[1])],
+            "slowest_dirs": [{"path": p, "ms": round(dt * 1000, 3)} for dt, p in sorted(self.slow, reverse=True)],
+        }
+
+    def report(self, out=sys.stderr):
+        total = time.perf_counter() - self.start
+        print("--- stats ---", file=out)
+        for name, dt in list(self.phases.items()) + [("total", total)]:
+            print(f"  {name:<10} {dt * 1000:10.1f} ms", file=out)
+        print(f"  dirs {self.dirs}, entries {self.entries} listed / {self.shown} shown", file=out)
+        print("  syscalls: " + ", ".join(f"{k} {v}" for k, v in self.syscalls.items()), file=out)
+        if self.rule_hits:
+            print(f"  ignore rule hits (top {self.top}):", file=out)
+            for (src, pat), n in sorted(self.rule_hits.items(), key=lambda kv: -kv[1])[:self.top]:
+                print(f"    {n:8}  {src}: {pat}", file=out)
+        if self.slow:
+            print(f"  slowest dirs (top {self.top}):", file=out)
+            for dt, path in sorted(self.slow, reverse=True):
+                print(f"    {dt * 1000:8.2f} ms  {path}", file=out)
+
+    def write_trace(self, file):
+        # Chrome の trace event 形式（chrome://tracing や Perfetto で開ける）。集計は otherData に入れる
+        with open(file, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": self.events or [], "otherData": self.summary()}, f, ensure_ascii=False)
+
+class Tree:
+    # 列指向のツリー表現。ノード i の属性は各配列の i 番目（0 が root、並びは walk と同じ先行順）。
+    # 名前は文字列表に intern し、シンボリックリンク先だけは疎な dict に持つ
+    DIR, FILE, OTHER = 0, 1, 2
+    F_SYMLINK, F_LAST, F_TRUNCATED, F_DENIED = 1, 2, 4, 8
+
+    def __init__(self, name: str, path: str = "", with_stat=False):
+        self.path = path
+        self.strings = []
+        self._string_ids = {}
+        self.name = array("I")
+        self.parent = array("i")
+        self.kind = array("B")
+        self.flags = array("B")
+        self.links = {}
+        self.series = {}  # --series でまとめたノード -> メンバー名のタプル
+        self.more = {}  # --limit-per-dir で省いた件数（兄弟の最後のノードに付ける）
+        # --size/--mtime 用（with_stat のときだけ持つ）と、rollup() が作る集計列
+        self.size = array("q") if with_stat else None
+        self.mtime = array("q") if with_stat else None
+        self.total = None
+        self.files = None
+        # --loc: ファイルの行数（数えていなければ -1）と言語（strings の id）。rollup() がディレクトリの合計と内訳を作る
+        self.lines = None
+        self.lang = None
+        self.total_lines = None
+        self.langs = None  # ディレクトリ -> {言語の id: 行数}
+        # --dupes: 重複グループ [(サイズ, ダイジェスト, [ノード])] と、ノード -> グループ番号
+        self.dupe_groups = None
+        self.dupes = None
+        # --merkle: ノードごとの構造ハッシュ（merkle() が作る）と、ハッシュに含めた属性
+        self.digest = None
+        self.merkle_fields = ()
+        self.add(-1, name, Tree.DIR, Tree.F_LAST)
+
+    def __len__(self):
+        return len(self.parent)
+
+    def intern(self, s: str):
+        i = self._string_ids.get(s)
+        if i is None:
+            i = self._string_ids[s] = len(self.strings)
+            self.strings.append(s)
+        return i
+
+    def add(self, parent: int, name: str, kind: int, flags: int = 0, link=None, st=None, series=None):
+        if series is not None:
+            self.series[len(self.parent)] = series
+        self.name.append(self.intern(name))
+        self.parent.append(parent)
+        self.kind.append(kind)
+        self.flags.append(flags)
+        if link is not None:
+            self.links[len(self.parent) - 1] = link
+        if self.size is not None:
+            self.size.append(st.st_size if st is not None else 0)
+            self.mtime.append(st.st_mtime_ns if st is not None else 0)
+        return len(self.parent) - 1
+
+    def name_of(self, i: int):
+        return self.strings[self.name[i]]
+
+    def paths(self):
+        # 全ノードのファイルシステム上のパス（先行順なので親のパスは必ず先に決まっている）
+        paths = [self.path]
+        parent, strings, name = self.parent, self.strings, self.name
+        for i in range(1, len(parent)):
+            paths.append(os.path.join(paths[parent[i]], strings[name[i]]))
+        return paths
+
+    @classmethod
+    def from_items(cls, name: str, items, path: str = "", with_stat=False):
+        tree = cls(name, path, with_stat)
+        stack = [0]  # 深さごとの直近ノード（stack[d] が深さ d の親候補）
+        for kind, e, depth, is_last, more in items:
+            if kind == "perm":
+                tree.flags[stack[depth]] |= Tree.F_DENIED
+                continue
+            flags = (Tree.F_LAST if is_last else 0) | (Tree.F_TRUNCATED if more else 0)
+            if e.is_symlink:
+                flags |= Tree.F_SYMLINK
+            k = Tree.DIR if e.is_dir else Tree.FILE if e.is_file else Tree.OTHER
+            del stack[depth:]
+            i = tree.add(stack[-1], e.name, k, flags, e.link if e.is_symlink else None, e.stat, e.series)
+            if more:
+                tree.more[i] = more
+            stack.append(i)
+        return tree
+
+    @classmethod
+    def merge(cls, name: str, trees, labels):
+        # 複数のツリーを仮想ルートの下にまとめる（各ツリーのルートは labels の名前の子になる）。id は先行順のまま連結
+        out = cls(name, "", with_stat=any(t.size is not None for t in trees))
+        for k, (t, label) in enumerate(zip(trees, labels)):
+            base = len(out)
+            for i in range(len(t)):
+                flags = t.flags[i]
+                if i == 0:
+                    flags = (flags & Tree.F_DENIED) | (Tree.F_LAST if k == len(trees) - 1 else 0)
+                st = Stat(t.size[i], t.mtime[i]) if t.size is not None and i else None
+                out.add(base + t.parent[i] if i else 0, t.name_of(i) if i else label, t.kind[i], flags, t.links.get(i), st, t.series.get(i))
+                if i in t.more:
+                    out.more[base + i] = t.more[i]
+        if any(t.lines is not None for t in trees):
+            out.lines = array("q", [-1])
+            out.lang = array("i", [-1])
+            for t in trees:
+                if t.lines is None:
+                    out.lines.extend(array("q", [-1]) * len(t))
+                    out.lang.extend(array("i", [-1]) * len(t))
+                    continue
+                out.lines.extend(t.lines)
+                out.lang.extend(out.intern(t.strings[k]) if k >= 0 else -1 for k in t.lang)
+        if any(t.dupe_groups is not None for t in trees):
+            # 重複はルートごとに見つけたグループをそのまま連結する（ルートをまたいだ照合はしない）
+            out.dupe_groups, out.dupes = [], {}
+            base = 1
+            for t in trees:
+                for size, digest, ids in t.dupe_groups or ():
+                    for i in ids:
+                        out.dupes[base + i] = len(out.dupe_groups)
+                    out.dupe_groups.append((size, digest, [base + i for i in ids]))
+                base += len(t)
+        if any(t.total is not None for t in trees):
+            out.rollup()
+        fields = next((t.merkle_fields for t in trees if t.digest is not None), None)
+        if fields is not None:
+            out.merkle(*fields)
+        return out
+
+    def end(self, i: int):
+        # i の部分木の次のノード番号。先行順なので、i か祖先のうち一番近い「次の兄弟」がそれ（兄弟は親番号の検索で探す）
+        parent, flags = self.parent, self.flags
+        while i > 0:
+            if not flags[i] & Tree.F_LAST:
+                try:
+                    return parent.index(parent[i], i + 1)
+                except ValueError:
+                    pass
+            i = parent[i]
+        return len(parent)
+
+    def child(self, i: int, name: str):
+        # i の子で名前が name のノード（なければ None）
+        parent, j = self.parent, i + 1
+        while True:
             try:
-                target = os.readlink(path)
-            except OSError:
-                target = "?"
-            name += f" -> {target}"
-        lines.append(f"{visual_prefix(pre)}{name}")
-        if truncated_flag:
-            lines.append(("".join("    " if p else "│   " for p in pre)) + "… (truncated)")
-    return "\n".join(lines)
-
-def to_json(root: Path, items):
-    node = {"name": root.name, "type": "dir", "children": []}
-    index = {str(root.resolve()): node}
-
-    for kind, path, pre, _ in items:
+                j = parent.index(i, j)
+            except ValueError:
+                return None
+            if self.name_of(j) == name:
+                return j
+            j += 1
+
+    def splice(self, i: int, sub, keep):
+        # i の配下を sub（0 が i に当たり、with_stat と --loc の列がそろったツリー）の配下で置き換える。
+        # keep は sub のノード -> self のノードで、その配下は sub に入れずに self から引き継ぐ（--watch が使う）。
+        # sub の各区間と引き継ぐ部分木は配列のスライスで写す。集計列（rollup・重複・ハッシュ）は捨てるので、呼び出し側で作り直す
+        parent, end = self.parent, self.end(i)
+        cols = [(self.kind, sub.kind), (self.flags, sub.flags)]
+        if self.size is not None:
+            cols += [(self.size, sub.size), (self.mtime, sub.mtime)]
+        if self.lines is not None:
+            cols.append((self.lines, sub.lines))
+        ids = [self.intern(s) for s in sub.strings] + [-1]  # sub の文字列 id -> self の id（末尾の -1 は lang の「なし」をそのまま通す）
+        name, par = array("I"), array("i")
+        region = [array(a.typecode) for a, _ in cols]
+        lang = array("i") if self.lines is not None else None
+        new_of = [i] * len(sub)
+        segments = []  # 引き継いだ範囲: (古い先頭, 古い末尾, ずらす量)
+        pos, lo = i + 1, 1
+        for k in sorted(keep) + [None]:
+            # sub の [lo, k] を写し、k を引き継ぐならその配下を self から写す
+            b = len(sub) if k is None else k + 1
+            new_of[lo:b] = range(pos, pos + b - lo)
+            name.extend(map(ids.__getitem__, sub.name[lo:b]))
+            par.extend(map(new_of.__getitem__, sub.parent[lo:b]))
+            for col, (_, s) in zip(region, cols):
+                col.extend(s[lo:b])
+            if lang is not None:
+                lang.extend(map(ids.__getitem__, sub.lang[lo:b]))
+            pos += b - lo
+            lo = b
+            o = keep.get(k)
+            if o is None:
+                continue
+            region[1][-1] |= self.flags[o] & Tree.F_DENIED
+            oa, ob = o + 1, self.end(o)
+            shift = pos - oa  # 引き継ぐ部分木の根 o は pos - 1 に移るので、配下の親番号も一律にずらせばよい
+            name.extend(self.name[oa:ob])
+            par.extend(map(shift.__add__, parent[oa:ob]))
+            for col, (old, _) in zip(region, cols):
+                col.extend(old[oa:ob])
+            if lang is not None:
+                lang.extend(self.lang[oa:ob])
+            segments.append((oa, ob, shift))
+            pos += ob - oa
+        delta = pos - end
+        name.extend(self.name[end:])
+        self.name[i + 1:] = name
+        par.extend(parent[end:] if not delta else array("i", (p + delta if p > i else p for p in parent[end:])))
+        parent[i + 1:] = par
+        for col, (old, _) in zip(region, cols):
+            col.extend(old[end:])
+            old[i + 1:] = col
+        if lang is not None:
+            lang.extend(self.lang[end:])
+            self.lang[i + 1:] = lang
+        self.flags[i] = (self.flags[i] & ~Tree.F_DENIED) | (sub.flags[0] & Tree.F_DENIED)
+        starts = [s[0] for s in segments]
+
+        def moved(d, fresh):
+            out = {}
+            for k, v in d.items():
+                if k <= i:
+                    out[k] = v
+                elif k >= end:
+                    out[k + delta] = v
+                else:
+                    s = bisect.bisect_right(starts, k) - 1
+                    if s >= 0 and k < segments[s][1]:
+                        out[k + segments[s][2]] = v
+            out.update((new_of[k], v) for k, v in fresh.items() if k)
+            return out
+
+        self.links, self.series, self.more = moved(self.links, sub.links), moved(self.series, sub.series), moved(self.more, sub.more)
+        self.total = self.files = self.total_lines = self.langs = None
+        self.dupe_groups = self.dupes = self.digest = None
+
+    def rollup(self):
+        # 先行順なので逆順に1回なめれば子→親へ集計できる（2回目の walk は不要）
+        n = len(self.parent)
+        total = array("q", bytes(8 * n))
+        files = array("q", bytes(8 * n))
+        size, kind, parent, series = self.size, self.kind, self.parent, self.series
+        for i in range(n - 1, 0, -1):
+            if kind[i] != Tree.DIR:
+                total[i] += size[i] if size is not None else 0
+                files[i] += len(series[i]) if i in series else 1
+            total[parent[i]] += total[i]
+            files[parent[i]] += files[i]
+        self.total, self.files = total, files
+        if self.lines is not None:
+            self._rollup_lines()
+
+    def merkle(self, with_size=False, with_mtime=False):
+        # rollup と同じく逆順の1回の走査で、子→親へ構造ハッシュを積み上げる。
+        # ディレクトリは子の (名前, ハッシュ) を名前順に、ファイルは種別・リンク先・--series のメンバーと、
+        # 指定があればサイズと mtime（JSON と同じ秒単位）を混ぜる。fs_tree_diff はハッシュの一致する部分木を丸ごと飛ばす
+        n = len(self.parent)
+        digest = [b""] * n
+        kids = {}
+        size = self.size if with_size else None
+        mtime = self.mtime if with_mtime else None
+        kind, parent, links, series = self.kind, self.parent, self.links, self.series
+        for i in range(n - 1, -1, -1):
+            h = hashlib.blake2b(digest_size=16)
+            if kind[i] == Tree.DIR:
+                h.update(b"d")
+                for name, d in sorted(kids.pop(i, ())):
+                    h.update(name.encode("utf-8", "surrogateescape") + b"\0" + d)
+            else:
+                h.update(b"f")
+                if size is not None:
+                    h.update(b"s%d" % size[i])
+                if mtime is not None:
+                    h.update(b"m%d" % (mtime[i] // 1_000_000_000))
+                if i in series:
+                    h.update(b"g" + "\0".join(series[i]).encode("utf-8", "surrogateescape"))
+            if i in links:
+                h.update(b"l" + links[i].encode("utf-8", "surrogateescape"))
+            digest[i] = h.digest()
+            if i:
+                kids.setdefault(parent[i], []).append((self.name_of(i), digest[i]))
+        self.digest = digest
+        self.merkle_fields = (size is not None, mtime is not None)
+
+    def _rollup_lines(self):
+        n = len(self.parent)
+        total = array("q", bytes(8 * n))
+        langs = {}
+        lines, lang, kind, parent = self.lines, self.lang, self.kind, self.parent
+        for i in range(n - 1, 0, -1):
+            p = parent[i]
+            if kind[i] == Tree.DIR:
+                sub = langs.get(i)
+                if sub:
+                    acc = langs.setdefault(p, {})
+                    for k, v in sub.items():
+                        acc[k] = acc.get(k, 0) + v
+            elif lines[i] >= 0:
+                total[i] = lines[i]
+                acc = langs.setdefault(p, {})
+                acc[lang[i]] = acc.get(lang[i], 0) + lines[i]
+            total[p] += total[i]
+        self.total_lines, self.langs = total, langs
+
+    def entry(self, i: int, path: str):
+        f = self.flags[i]
+        st = Stat(self.size[i], self.mtime[i]) if self.size is not None and i else None
+        is_dir = self.kind[i] == Tree.DIR
+        total = files = lines = language = dupe = None
+        if self.total is not None and is_dir:
+            total, files = self.total[i], self.files[i]
+        if self.total_lines is not None and is_dir:
+            lines = self.total_lines[i]
+            language = {self.strings[k]: v for k, v in sorted(self.langs.get(i, {}).items(), key=lambda kv: (-kv[1], self.strings[kv[0]]))}
+        elif self.lines is not None and self.lines[i] >= 0:
+            lines, language = self.lines[i], self.strings[self.lang[i]]
+        if self.dupes is not None:
+            dupe = self.dupes.get(i)
+        digest = self.digest[i].hex() if self.digest is not None and is_dir else None
+        return Entry(self.name_of(i), path, is_dir, self.kind[i] == Tree.FILE, bool(f & Tree.F_SYMLINK),
+                     self.links.get(i), st, total, files, lines, language, dupe, self.series.get(i), digest)
+
+    def _order(self, sort):
+        # (ノード, is_last, 省いた件数) を先行順で返す。sort="size" なら兄弟を集計サイズの大きい順に並べ替える
+        flags, n, more = self.flags, len(self.parent), self.more
+        if sort != "size":
+            for i in range(1, n):
+                yield i, bool(flags[i] & Tree.F_LAST), more.get(i, 0)
+            return
+        if self.total is None:
+            self.rollup()
+        children = [[] for _ in range(n)]
+        for i in range(1, n):
+            children[self.parent[i]].append(i)
+        total, name_of = self.total, self.name_of
+
+        def kids_of(p):
+            kids = sorted(children[p], key=lambda c: (-total[c], name_of(c).lower()))
+            children[p] = None
+            hidden = sum(more.get(c, 0) for c in kids)
+            last = len(kids) - 1
+            return iter([(c, k == last, hidden if k == last else 0) for k, c in enumerate(kids)])
+
+        stack = [kids_of(0)]
+        while stack:
+            nxt = next(stack[-1], None)
+            if nxt is None:
+                stack.pop()
+                continue
+            yield nxt
+            stack.append(kids_of(nxt[0]))
+
+    def root(self):
+        return self.entry(0, self.path)
+
+    def items(self, sort="name"):
+        # walk と同じ形の item 列を再生する（renderer はどちらからでも読める）
+        flags, parent = self.flags, self.parent
+        if flags[0] & Tree.F_DENIED:
+            yield ("perm", self.root(), 0, True, 0)
+        ids, paths = [0], [self.path]  # 開いている祖先（深さ = len(ids)）
+        for i, is_last, more in self._order(sort):
+            p = parent[i]
+            while ids[-1] != p:
+                ids.pop()
+                paths.pop()
+            path = os.path.join(paths[-1], self.name_of(i))
+            e = self.entry(i, path)
+            depth = len(ids)
+            yield ("node", e, depth, is_last, more)
+            if flags[i] & Tree.F_DENIED:
+                yield ("perm", e, depth, is_last, 0)
+            ids.append(i)
+            paths.append(path)
+
+    def to_dict(self, cols=()):
+        nodes = [{"name": self.name_of(0), "type": "dir", **dict(json_meta(self.root(), cols)), "children": []}]
+        for kind, e, depth, _, _ in self.items():
+            if kind == "perm":
+                continue
+            cur = {"name": e.name, "type": "dir" if e.is_dir else "file"}
+            if e.is_symlink:
+                cur["symlink_to"] = e.link
+            cur.update(json_meta(e, cols))
+            del nodes[depth:]
+            nodes[-1]["children"].append(cur)
+            if e.is_dir:
+                cur["children"] = []
+                nodes.append(cur)
+        return nodes[0]
+
+def to_json(root: Path, items, cols=()):
+    return Tree.from_items(root.name, items, with_stat=bool(cols)).to_dict(cols)
+
+def json_meta(e: Entry, cols):
+    # --size / --mtime / --rollup の JSON フィールド（キー順も固定）
+    out = []
+    if e.stat is not None:
+        if "size" in cols and not e.is_dir:
+            out.append(("size", e.stat.st_size))
+        if "mtime" in cols:
+            out.append(("mtime", e.stat.st_mtime_ns // 1_000_000_000))
+    if e.total is not None and "rollup" in cols:
+        out.append(("total_size", e.total))
+        out.append(("files", e.files))
+    if e.lines is not None and "loc" in cols:
+        out.append(("lines", e.lines))
+        out.append(("languages" if e.is_dir else "language", e.language))
+    if e.dupe is not None and "dupes" in cols:
+        out.append(("dupe", e.dupe))
+    if e.digest is not None and "merkle" in cols:
+        out.append(("hash", e.digest))
+    if e.series is not None:
+        out.append(("series", {"count": len(e.series), "oldest": e.series[0], "newest": e.series[-1], "members": list(e.series)}))
+    return out
+
+def iter_json(name: str, items, indent=2, cols=(), root=None):
+    # to_json と同じスキーマを、json.dumps(..., indent=indent) と同じ書式で逐次出力する
+    enc = functools.partial(json.dumps, ensure_ascii=False)
+    comma = "," if indent is not None else ", "
+
+    def pad(level):
+        return "\n" + " " * (indent * level) if indent is not None else ""
+
+    def head(depth, e, name, kind):
+        s = "{" + pad(2 * depth + 1) + '"name": ' + enc(name) + comma + pad(2 * depth + 1) + '"type": "' + kind + '"'
+        if e is None:
+            return s
+        if e.is_symlink:
+            s += comma + pad(2 * depth + 1) + '"symlink_to": ' + enc(e.link)
+        for k, v in json_meta(e, cols):
+            s += comma + pad(2 * depth + 1) + enc(k) + ": " + enc(v)
+        return s
+
+    def open_dir(depth, e, name):
+        return head(depth, e, name, "dir") + comma + pad(2 * depth + 1) + '"children": ['
+
+    def close_dir(depth, n_children):
+        return (pad(2 * depth + 1) if n_children else "") + "]" + pad(2 * depth) + "}"
+
+    yield open_dir(0, root, name)
+    counts = [0]  # 開いているディレクトリごとの子の数（先頭が root）
+    for kind, e, depth, _, _ in items:
         if kind == "perm":
             continue
-        p = path.resolve()
-        parent = p.parent.resolve()
-        parent_node = index.get(str(parent))
-        if parent_node is None:
-            continue
-        cur = {"name": path.name, "type": "dir" if path.is_dir() else "file"}
-        if path.is_symlink():
-            try:
-                cur["symlink_to"] = os.readlink(path)
-            except OSError:
-                cur["symlink_to"] = "?"
-        parent_node.setdefault("children", []).append(cur)
-        if path.is_dir():
-            index[str(p)] = cur
-            cur.setdefault("children", [])
-    return node
+        while len(counts) > depth:
+            yield close_dir(len(counts) - 1, counts.pop())
+        yield (comma if counts[-1] else "") + pad(2 * depth)
+        counts[-1] += 1
+        if e.is_dir:
+            yield open_dir(depth, e, e.name)
+            counts.append(0)
+        else:
+            yield head(depth, e, e.name, "file") + pad(2 * depth) + "}"
+    while counts:
+        yield close_dir(len(counts) - 1, counts.pop())
 
-def main():
-    ap = argparse.ArgumentParser(description="Print tree-like view of a directory (no external deps).")
-    ap.add_argument("path", nargs="?", default=".", help="root directory (default: .)")
+def iter_ndjson(root: Path, items, cols=()):
+    # 1エントリ1行のフラットな JSON（path はルートからの相対パス）
+    base = len(os.path.join(str(root), ""))
+    for kind, e, depth, _, _ in items:
+        rec = {"path": e.path[base:], "type": "dir" if e.is_dir else "file", "depth": depth}
+        if kind == "perm":
+            rec["error"] = "permission denied"
+        else:
+            if e.is_symlink:
+                rec["symlink_to"] = e.link
+            rec.update(json_meta(e, cols))
+        yield json.dumps(rec, ensure_ascii=False)
+
+@dataclass
+class TreeOptions:
+    # CLI フラグと 1:1 に対応する走査オプション
+    max_depth: Optional[int] = None
+    ignores: List[str] = field(default_factory=list)
+    includes: List[str] = field(default_factory=list)
+    show_hidden: bool = False
+    dirs_only: bool = False
+    files_only: bool = False
+    limit_per_dir: int = 0
+    follow_symlinks: bool = False
+    relative: bool = False
+    jobs: int = 1
+    cache: bool = False
+    cache_dir: Optional[str] = None
+    size: bool = False
+    mtime: bool = False
+    rollup: bool = False
+    sort: str = "name"
+    stat_jobs: int = 1
+    loc: bool = False
+    loc_jobs: int = 0
+    dupes: bool = False
+    dupes_jobs: int = 0
+    merkle: bool = False
+    series: bool = False
+    series_patterns: List[str] = field(default_factory=list)
+    git_index: bool = False
+    git_untracked: bool = False
+    stats: bool = False
+    stats_top: int = 10
+    stats_dump: Optional[str] = None
+
+    @classmethod
+    def from_args(cls, args):
+        return cls(**{f.name: getattr(args, f.name) for f in fields(cls)})
+
+    def columns(self):
+        return tuple(c for c in ("size", "mtime", "rollup", "loc", "dupes", "merkle") if getattr(self, c))
+
+    @property
+    def needs_stat(self):
+        # --loc は行数キャッシュのキーに (size, mtime) を、--dupes はサイズでの振り分けに st_size を使う
+        return self.size or self.mtime or self.rollup or self.loc or self.dupes or self.sort == "size"
+
+    @property
+    def series_regexes(self):
+        # --series-pattern を1つでも渡せば --series なしでも有効（既定パターンは置き換わる）
+        if self.series_patterns:
+            return tuple(self.series_patterns)
+        return DEFAULT_SERIES if self.series else ()
+
+    @property
+    def needs_tree(self):
+        # ディレクトリの集計値は配下を全部見るまで決まらないので、rollup/サイズ順/行数/重複/ハッシュはツリーを組んでから出力する
+        return self.rollup or self.loc or self.dupes or self.merkle or self.sort == "size"
+
+def add_tree_arguments(ap, path=True):
+    if path:
+        ap.add_argument("path", nargs="?", default=".", help="root directory (default: .)")
     ap.add_argument("--max-depth", "-d", type=int, help="max depth (default: unlimited)")
-    ap.add_argument("--ignore", "-I", action="append", default=[], help="glob to ignore (repeatable)")
+    ap.add_argument("--ignore", "-I", dest="ignores", action="append", default=[], help="glob to ignore (repeatable)")
+    ap.add_argument("--include", "-P", dest="includes", action="append", default=[], help="only show paths matching this glob plus their ancestors, e.g. 'lib/**' (repeatable)")
     ap.add_argument("--show-hidden", action="store_true", help="show dotfiles")
     ap.add_argument("--dirs-only", action="store_true", help="show directories only")
     ap.add_argument("--files-only", action="store_true", help="show files only")
-    ap.add_argument("--json", action="store_true", help="output as JSON")
     ap.add_argument("--limit-per-dir", type=int, default=0, help="limit entries per directory (0=unlimited)")
     ap.add_argument("--follow-symlinks", action="store_true", help="descend into symlinked directories")
     ap.add_argument("--relative", action="store_true", help="print root as '.' instead of folder name")
-    args = ap.parse_args()
+    ap.add_argument("--jobs", "-j", type=int, default=1, help="list directories with N threads (output order unchanged)")
+    ap.add_argument("--cache", action=argparse.BooleanOptionalAction, default=False, help="reuse cached listings of directories whose mtime is unchanged")
+    ap.add_argument("--cache-dir", help="cache directory (default: $XDG_CACHE_HOME/fs_tree)")
+    ap.add_argument("--size", action="store_true", help="show file sizes")
+    ap.add_argument("--mtime", action="store_true", help="show modification times")
+    ap.add_argument("--rollup", action="store_true", help="show total bytes and file count per directory (of the entries shown)")
+    ap.add_argument("--sort", choices=("name", "size"), default="name", help="sibling order (size: largest first)")
+    ap.add_argument("--stat-jobs", type=int, default=1, help="issue lstat calls with N threads")
+    ap.add_argument("--loc", action="store_true", help="count lines per file and roll up lines and languages per directory")
+    ap.add_argument("--loc-jobs", type=int, default=0, help="processes for --loc (default: all cores)")
+    ap.add_argument("--merkle", action="store_true", help="add a structural hash to each directory (names, types, link targets, plus --size/--mtime if given) for fs_tree_diff.py")
+    ap.add_argument("--series", action="store_true", help="collapse sibling files that differ only in a version/timestamp suffix (e.g. *.bak.<epoch>) into one node")
+    ap.add_argument("--series-pattern", dest="series_patterns", action="append", default=[], type=series_regex, metavar="REGEX",
+                    help="regex with a (?P<v>...) group marking the version part; replaces the --series defaults (repeatable)")
+    ap.add_argument("--dupes", action="store_true", help="find duplicate files (report groups and reclaimable bytes instead of the tree)")
+    ap.add_argument("--dupes-jobs", type=int, default=0, help="hashing threads for --dupes (default: cores + 4)")
+    ap.add_argument("--git-index", action="store_true", help="list tracked files from .git/index instead of walking directories")
+    ap.add_argument("--git-untracked", action="store_true", help="with --git-index, also show untracked files that are not ignored")
+    ap.add_argument("--stats", action="store_true", help="print phase timings and walk counters to stderr")
+    ap.add_argument("--stats-top", type=int, default=10, help="rows in the --stats rule-hit and slowest-dir tables")
+    ap.add_argument("--stats-dump", metavar="FILE", help="also write a cProfile dump (*.prof) or a JSON trace (other names); implies --stats")
 
-    root = Path(args.path).resolve()
+def resolve_root(path):
+    root = Path(path).resolve()
     if not root.exists() or not root.is_dir():
         print(f"Error: directory not found: {root}", file=sys.stderr)
         sys.exit(2)
+    return root
+
+def open_cache(root: Path, opts: TreeOptions):
+    # walk に渡す一覧の出どころ（None なら毎回 scandir）
+    if opts.git_index:
+        from fs_tree_gitindex import GitIndexListing
+        try:
+            return GitIndexListing(str(root), opts.git_untracked)
+        except (OSError, ValueError) as ex:
+            print(f"Warning: --git-index unavailable ({ex}); walking the filesystem", file=sys.stderr)
+    if not opts.cache:
+        return None
+    return ListingCache(ListingCache.default_file(str(root), opts.cache_dir), str(root))
+
+def close_cache(cache):
+    if not isinstance(cache, ListingCache):
+        return
+    try:
+        cache.save()
+    except (OSError, UnicodeError) as ex:
+        print(f"Warning: cache not saved: {ex}", file=sys.stderr)
+    print(f"cache: {cache.hits} hits, {cache.misses} misses ({cache.file})", file=sys.stderr)
+
+def open_stats(opts: TreeOptions, matcher=None):
+    if not (opts.stats or opts.stats_dump):
+        return None
+    dump = opts.stats_dump or ""
+    stats = Stats(opts.stats_top, trace=bool(dump) and not dump.endswith(".prof"))
+    if matcher is not None:
+        matcher.on_hit = stats.rule_hit
+    if dump.endswith(".prof"):
+        import cProfile
+        stats.profile = cProfile.Profile()
+        stats.profile.enable()
+    return stats
 
-    items = list(list_dir(
+def close_stats(stats, opts: TreeOptions):
+    if stats is None:
+        return
+    if stats.profile is not None:
+        stats.profile.disable()
+        stats.profile.dump_stats(opts.stats_dump)
+    elif opts.stats_dump:
+        stats.write_trace(opts.stats_dump)
+    stats.report()
+
+def walk(root: Path, opts: TreeOptions, matcher=None, want_stat=False, cache=None, stats=None, start=None, on_dir=None):
+    return list_dir(
         root=root,
-        max_depth=args.max_depth,
-        ignores=args.ignore,
-        show_hidden=args.show_hidden,
-        dirs_only=args.dirs_only,
-        files_only=args.files_only,
-        limit_per_dir=args.limit_per_dir,
-        follow_symlinks=args.follow_symlinks
-    ))
-
-    if args.json:
-        data = to_json(root, items)
-        if args.relative:
-            data["name"] = "."
-        print(json.dumps(data, ensure_ascii=False, indent=2))
+        max_depth=opts.max_depth,
+        ignores=opts.ignores,
+        show_hidden=opts.show_hidden,
+        dirs_only=opts.dirs_only,
+        files_only=opts.files_only,
+        limit_per_dir=opts.limit_per_dir,
+        follow_symlinks=opts.follow_symlinks,
+        want_stat=want_stat or opts.needs_stat,
+        matcher=matcher,
+        jobs=opts.jobs,
+        cache=cache,
+        stat_jobs=opts.stat_jobs,
+        stats=stats,
+        includes=opts.includes,
+        series=opts.series_regexes,
+        start=start,
+        on_dir=on_dir
+    )
+
+def build_tree(root: Path, opts: TreeOptions, matcher=None, cache=None, stats=None, loc_cache=None, hash_cache=None, on_dir=None):
+    # loc_cache / hash_cache: --watch が再構築をまたいで持つ行数・ハッシュの常駐キャッシュ（loc_pass / find_dupes に渡す）。
+    # on_dir は list_dir に渡す（--watch が一覧したディレクトリごとの文脈を控える）
+    name = "." if opts.relative else root.name
+    items = walk(root, opts, matcher, cache=cache, stats=stats, on_dir=on_dir)
+    if stats is None:
+        tree = Tree.from_items(name, items, str(root), with_stat=opts.needs_stat)
+        if opts.loc:
+            from fs_tree_loc import loc_pass
+            loc_pass(tree, opts, loc_cache)
+        if opts.dupes:
+            from fs_tree_dupes import find_dupes
+            find_dupes(tree, opts.dupes_jobs, hash_cache)
+        if opts.needs_tree:
+            tree.rollup()
+        if opts.merkle:
+            tree.merkle(opts.size, opts.mtime)
+        return tree
+    with stats.phase("tree"):
+        tree = Tree.from_items(name, stats.pull("walk", items), str(root), with_stat=opts.needs_stat)
+    if opts.loc:
+        from fs_tree_loc import loc_pass
+        with stats.phase("loc"):
+            loc_pass(tree, opts, loc_cache)
+    if opts.dupes:
+        from fs_tree_dupes import find_dupes
+        with stats.phase("dupes"):
+            find_dupes(tree, opts.dupes_jobs, hash_cache)
+    with stats.phase("tree"):
+        if opts.needs_tree:
+            tree.rollup()
+        if opts.merkle:
+            tree.merkle(opts.size, opts.mtime)
+    return tree
+
+def write_json(tree: Tree, fp, indent=None, cols=(), sort="name"):
+    for chunk in iter_json(tree.name_of(0), tree.items(sort), indent, cols, root=tree.root()):
+        fp.write(chunk)
+
+def main():
+    ap = argparse.ArgumentParser(description="Print tree-like view of a directory (no external deps).")
+    add_tree_arguments(ap)
+    fmt = ap.add_mutually_exclusive_group()
+    fmt.add_argument("--json", action="store_true", help="output as JSON (streamed)")
+    fmt.add_argument("--ndjson", action="store_true", help="output one JSON record per entry")
+    args = ap.parse_args()
+
+    root = resolve_root(args.path)
+    opts = TreeOptions.from_args(args)
+    name = "." if args.relative else root.name
+    cols = opts.columns()
+    matcher = IgnoreMatcher(opts.ignores, opts.show_hidden)
+    stats = open_stats(opts, matcher)
+    cache = open_cache(root, opts)
+    if opts.needs_tree:
+        tree = build_tree(root, opts, matcher, cache=cache, stats=stats)
+        items, root_e = tree.items(opts.sort), tree.root()
     else:
-        txt = to_text(root, items)
-        if args.relative:
-            txt = txt.replace(txt.splitlines()[0], ".")
-        print(txt)
+        items, root_e = walk(root, opts, matcher, cache=cache, stats=stats), None
+        if stats is not None:
+            items = stats.pull("walk", items)
+
+    try:
+        with stats.phase("render") if stats is not None else contextlib.nullcontext():
+            if opts.dupes:
+                # --dupes はツリーの代わりに重複グループの一覧を出す
+                from fs_tree_dupes import iter_report_ndjson, iter_report_text, report_dict
+                if args.json:
+                    json.dump(report_dict(tree), sys.stdout, ensure_ascii=False, indent=2)
+                    print()
+                else:
+                    write_stream(iter_report_ndjson(tree) if args.ndjson else iter_report_text(tree), sys.stdout, sep="\n")
+            elif args.json:
+                write_stream(iter_json(name, items, cols=cols, root=root_e), sys.stdout)
+                print()
+            elif args.ndjson:
+                write_stream(iter_ndjson(root, items, cols), sys.stdout, sep="\n")
+            else:
+                header = name if args.relative else name + "/"
+                if root_e is not None:
+                    header += text_meta(root_e, cols)
+                write_text(header, items, sys.stdout, cols)
+        close_cache(cache)
+    except BrokenPipeError:
+        # | head などで読み手が先に閉じた場合は静かに終了
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, sys.stdout.fileno())
+        sys.exit(1)
+    close_stats(stats, opts)
 
 if __name__ == "__main__":
     main()
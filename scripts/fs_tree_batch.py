@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+# coding: utf-8
+import argparse, json, os, sys
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+
+from fs_tree import IgnoreMatcher, Tree, TreeOptions, add_tree_arguments, build_tree, close_cache, open_cache, text_meta, write_json, write_text
+
+EXT = {"text": ".txt", "json": ".json", "html": ".html"}
+
+def read_manifest(file):
+    # 1行1ルート。空行と # 以降は無視し、相対パスはマニフェストの場所から解決する
+    base = os.path.dirname(os.path.abspath(file))
+    roots = []
+    with open(file, encoding="utf-8") as f:
+        for line in f:
+            line = line.split("#", 1)[0].strip()
+            if line:
+                roots.append(os.path.join(base, line))
+    return roots
+
+def labels_for(roots):
+    # 共通の親からの相対パス（ルートが1つならフォルダ名）
+    if len(roots) == 1:
+        return [roots[0].name]
+    common = os.path.commonpath([str(r) for r in roots])
+    return [os.path.relpath(r, common).replace(os.sep, "/") if str(r) != common else r.name for r in roots]
+
+def write_one(fmt, tree, out, opts, payload="json"):
+    cols = opts.columns()
+    if fmt == "html":
+        from fs_tree_html import write_html
+        write_html(Path(out), tree, cols, opts.sort, payload)
+        return
+    with open(out, "w", encoding="utf-8") as f:
+        if fmt == "json":
+            write_json(tree, f, indent=2, cols=cols, sort=opts.sort)
+            f.write("\n")
+        else:
+            write_text(tree.name_of(0) + "/" + text_meta(tree.root(), cols), tree.items(opts.sort), f, cols)
+
+# プロセスプール用: マッチャーはワーカープロセスごとに1つ作って使い回す
+_matcher = None
+
+def _init_worker(opts):
+    global _matcher
+    _matcher = IgnoreMatcher(opts.ignores, opts.show_hidden)
+
+def build_one(root, label, opts, matcher=None, out=None, fmt=None, payload="json"):
+    # 1ルート分の走査。out があればその場でファイルに書き、ツリーの代わりに件数を返す
+    cache = open_cache(root, opts)
+    tree = build_tree(root, opts, matcher if matcher is not None else _matcher, cache=cache)
+    close_cache(cache)
+    tree.name[0] = tree.intern(label)
+    if out is None:
+        return tree
+    write_one(fmt, tree, out, opts, payload)
+    return len(tree) - 1
+
+def main():
+    ap = argparse.ArgumentParser(description="Generate trees for many roots in one process (shared ignore rules, parallel scans).")
+    add_tree_arguments(ap, path=False)
+    ap.add_argument("roots", nargs="*", help="root directories")
+    ap.add_argument("--manifest", action="append", default=[], help="file listing one root per line (repeatable)")
+    ap.add_argument("--format", choices=("text", "json", "html"), default="text", help="output format (default: text)")
+    ap.add_argument("-o", "--output", help="combined output file (default: stdout; required for html)")
+    ap.add_argument("--out-dir", help="write one file per root into this directory instead of a combined document")
+    ap.add_argument("--workers", "-w", type=int, default=min(8, os.cpu_count() or 1), help="roots scanned concurrently")
+    ap.add_argument("--processes", action="store_true", help="use worker processes instead of threads")
+    ap.add_argument("--payload", choices=("json", "compact", "gzip"), default="json", help="embedded data format for html")
+    args = ap.parse_args()
+
+    paths = list(args.roots)
+    for m in args.manifest:
+        paths += read_manifest(m)
+    if not paths:
+        ap.error("no roots given (pass directories or --manifest)")
+    roots = []
+    for p in paths:
+        r = Path(p).resolve()
+        if not r.is_dir():
+            print(f"Error: directory not found: {r}", file=sys.stderr)
+            sys.exit(2)
+        if r not in roots:
+            roots.append(r)
+    if args.format == "html" and not (args.output or args.out_dir):
+        ap.error("--format html needs -o or --out-dir")
+    if args.stats or args.stats_dump:
+        print("Warning: --stats is not supported in batch mode", file=sys.stderr)
+
+    opts = TreeOptions.from_args(args)
+    opts.stats, opts.stats_dump = False, None
+    labels = labels_for(roots)
+    outs = [None] * len(roots)
+    if args.out_dir:
+        os.makedirs(args.out_dir, exist_ok=True)
+        outs = [os.path.join(args.out_dir, label.replace("/", "__") + EXT[args.format]) for label in labels]
+
+    if args.processes:
+        pool = ProcessPoolExecutor(args.workers, initializer=_init_worker, initargs=(opts,))
+        matcher = None
+    else:
+        pool = ThreadPoolExecutor(args.workers)
+        matcher = IgnoreMatcher(opts.ignores, opts.show_hidden)
+    with pool:
+        futs = [pool.submit(build_one, r, label, opts, matcher, out, args.format, args.payload)
+                for r, label, out in zip(roots, labels, outs)]
+        if args.out_dir:
+            for out, fut in zip(outs, futs):
+                print(f"{out}  ({fut.result()} entries)")
+            return
+        if args.format != "html":
+            # 結合出力は先頭のルートから、出来上がった順ではなく指定順に書く
+            f = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+            try:
+                write_combined(args.format, roots, (fut.result() for fut in futs), opts, f)
+            except BrokenPipeError:
+                devnull = os.open(os.devnull, os.O_WRONLY)
+                os.dup2(devnull, sys.stdout.fileno())
+                sys.exit(1)
+            if f is not sys.stdout:
+                f.close()
+                print(args.output)
+            return
+        trees = [fut.result() for fut in futs]
+
+    # html は各ルートを仮想ルートの下にまとめ、ルート選択つきの1ページにする
+    from fs_tree_html import write_html
+    out = Path(args.output).resolve()
+    write_html(out, Tree.merge(f"{len(roots)} roots", trees, labels), opts.columns(), opts.sort, args.payload,
+               roots=[str(r) for r in roots])
+    print(str(out))
+
+def write_combined(fmt, roots, trees, opts, f):
+    cols = opts.columns()
+    if fmt == "json":
+        # {"roots": [{"path": ..., "tree": {...}}, ...]}
+        f.write('{"roots": [')
+        for k, (r, tree) in enumerate(zip(roots, trees)):
+            f.write((", " if k else "") + '{"path": ' + json.dumps(str(r), ensure_ascii=False) + ', "tree": ')
+            write_json(tree, f, cols=cols, sort=opts.sort)
+            f.write("}")
+        f.write("]}\n")
+        return
+    for k, tree in enumerate(trees):
+        if k:
+            f.write("\n")
+        write_text(tree.name_of(0) + "/" + text_meta(tree.root(), cols), tree.items(opts.sort), f, cols)
+
+if __name__ == "__main__":
+    main()
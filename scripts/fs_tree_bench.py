@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+# coding: utf-8
+import argparse, fnmatch, json, os, platform, random, shutil, sys, tempfile, time, tracemalloc
+from pathlib import Path
+
+from fs_tree import IgnoreMatcher, Tree, TreeOptions, iter_json, iter_text, walk
+
+SHAPES = ("wide", "deep", "fanout", "symlinks", "gitignore")
+EXTS = (".js", ".ts", ".tsx", ".json", ".md", ".py", ".css", ".png", ".map", ".d.ts")
+
+# ===== 合成ツリー（seed と scale が同じなら同じツリーになる） =====
+
+def _touch(path, rnd=None):
+    with open(path, "w") as f:
+        if rnd is not None:
+            f.write("x" * rnd.randrange(0, 1024))
+
+def _files(rnd, d, n, prefix="file"):
+    for i in range(n):
+        _touch(os.path.join(d, f"{prefix}_{i}{rnd.choice(EXTS)}"), rnd)
+
+def gen_wide(dest, rnd, scale):
+    # 1 ディレクトリに大量のファイル
+    _files(rnd, dest, 20000 * scale)
+    for j in range(20):
+        os.makedirs(os.path.join(dest, f"dir_{j}"))
+
+def gen_deep(dest, rnd, scale):
+    # 深い一本道（各階層に少しだけファイル）
+    d = dest
+    for depth in range(200 * scale):
+        d = os.path.join(d, f"d{depth % 10}")
+        os.makedirs(d)
+        _files(rnd, d, 3)
+
+def gen_fanout(dest, rnd, scale):
+    # node_modules 風: パッケージの中にさらに node_modules がある
+    def package(d, level):
+        os.makedirs(os.path.join(d, "lib"))
+        _touch(os.path.join(d, "package.json"), rnd)
+        _touch(os.path.join(d, "index.js"), rnd)
+        _files(rnd, os.path.join(d, "lib"), rnd.randrange(4, 16), "mod")
+        if level < 3:
+            for k in range(rnd.randrange(2, 6)):
+                package(os.path.join(d, "node_modules", f"dep_{level}_{k}"), level + 1)
+
+    for i in range(40 * scale):
+        package(os.path.join(dest, "node_modules", f"pkg_{i}"), 1)
+    _files(rnd, dest, 10, "src")
+
+def gen_symlinks(dest, rnd, scale):
+    # 実体と、それを指す大量のシンボリックリンク（ディレクトリへのリンクとループも含む）
+    real = os.path.join(dest, "real")
+    for j in range(50 * scale):
+        d = os.path.join(real, f"pkg_{j}")
+        os.makedirs(d)
+        _files(rnd, d, 20)
+    links = os.path.join(dest, "links")
+    os.makedirs(links)
+    for j in range(50 * scale):
+        os.symlink(os.path.join("..", "real", f"pkg_{j}"), os.path.join(links, f"pkg_{j}"))
+        # 拡張子は _files がランダムに付けるので、実際に作られた名前を指す（壊れたリンクは下の dangling だけ）
+        for i, name in enumerate(sorted(os.listdir(os.path.join(real, f"pkg_{j}")))):
+            os.symlink(os.path.join("..", "real", f"pkg_{j}", name), os.path.join(links, f"f_{j}_{i}"))
+    os.symlink("..", os.path.join(links, "loop"))
+    os.symlink("missing", os.path.join(links, "dangling"))
+
+def gitignore_rules(rnd, n):
+    # 名前・拡張子・アンカー付きパス・ディレクトリ限定・否定・** を混ぜたルール
+    out = []
+    for i in range(n):
+        r = i % 7
+        if r == 0:
+            out.append(f"*{rnd.choice(EXTS)}.bak{i}")
+        elif r == 1:
+            out.append(f"build_{i}/")
+        elif r == 2:
+            out.append(f"/src/mod_{i % 40}/gen_{i}")
+        elif r == 3:
+            out.append(f"**/cache_{i}")
+        elif r == 4:
+            out.append(f"file_{i}.tmp")
+        elif r == 5:
+            out.append(f"src/**/*.log{i}")
+        else:
+            out.append(f"!keep_{i}.md")
+    out += ["*.map", "dist/", "!important.map"]
+    return "\n".join(out) + "\n"
+
+def gen_gitignore(dest, rnd, scale):
+    # 数百行の .gitignore と、サブディレクトリごとの .gitignore
+    with open(os.path.join(dest, ".gitignore"), "w") as f:
+        f.write(gitignore_rules(rnd, 400))
+    for j in range(40 * scale):
+        d = os.path.join(dest, "src", f"mod_{j}")
+        os.makedirs(os.path.join(d, "dist"))
+        _files(rnd, d, 60)
+        _files(rnd, os.path.join(d, "dist"), 10)
+        if j % 4 == 0:
+            with open(os.path.join(d, ".gitignore"), "w") as f:
+                f.write(gitignore_rules(rnd, 20))
+
+def generate(shape, dest, scale=1, seed=0):
+    os.makedirs(dest, exist_ok=True)
+    globals()["gen_" + shape](dest, random.Random(f"{shape}:{seed}"), scale)
+
+# ===== 計測 =====
+
+def measure(fn, repeat=3):
+    # 最速の経過時間と、tracemalloc を有効にした別の1回のピークメモリ
+    best = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        n = fn()
+        dt = time.perf_counter() - t0
+        best = dt if best is None else min(best, dt)
+    tracemalloc.start()
+    try:
+        fn()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {"entries": n, "seconds": round(best, 6), "rate": round(n / best, 1) if best else None, "peak_bytes": peak}
+
+def scenarios(root: Path):
+    # フェーズごとのシナリオ。各関数は処理した件数を返す
+    opts = TreeOptions(show_hidden=True)
+    items = list(walk(root, opts))
+    tree = Tree.from_items(root.name, items, str(root))
+
+    def run_walk(**kw):
+        def fn():
+            return sum(1 for _ in walk(root, TreeOptions(show_hidden=True, **kw)))
+        return fn
+
+    matcher = IgnoreMatcher(show_hidden=True)
+    frames = matcher.root_frames(root)
+    if os.path.isfile(os.path.join(root, ".gitignore")):
+        frames = matcher.descend(frames, "", os.path.join(root, ".gitignore"))
+    base = len(os.path.join(str(root), ""))
+    probes = [(e.name, e.path[base:], e.is_dir) for kind, e, _, _, _ in items if kind == "node"]
+
+    def match():
+        ignored = matcher.ignored
+        for name, rel, is_dir in probes:
+            ignored(frames, name, rel, is_dir)
+        return len(probes)
+
+    def text():
+        return sum(1 for _ in iter_text(root.name + "/", items))
+
+    def json_():
+        for _ in iter_json(root.name, items, indent=None):
+            pass
+        return len(items)
+
+    def build():
+        return len(Tree.from_items(root.name, items, str(root)))
+
+    def loc():
+        from fs_tree_loc import count_tree
+        return count_tree(Tree.from_items(root.name, items, str(root), with_stat=True))
+
+    def html(payload):
+        def fn():
+            from fs_tree_html import write_html
+            with tempfile.TemporaryDirectory() as d:
+                write_html(Path(d) / "tree.html", tree, payload=payload)
+            return len(tree)
+        return fn
+
+    return {
+        "walk": run_walk(),
+        "walk_jobs4": run_walk(jobs=4),
+        "walk_stat": run_walk(size=True),
+        "match": match,
+        "text": text,
+        "json": json_,
+        "tree": build,
+        "loc": loc,
+        "html": html("json"),
+        "html_gzip": html("gzip"),
+    }
+
+def run(shapes, scale=1, seed=0, repeat=3, workdir=None, only=None, log=sys.stderr):
+    results = {}
+    tmp = None
+    if workdir is None:
+        tmp = workdir = tempfile.mkdtemp(prefix="fs_tree_bench.")
+    try:
+        for shape in shapes:
+            root = Path(workdir) / f"{shape}-s{scale}-seed{seed}"
+            if not root.exists():
+                t0 = time.perf_counter()
+                generate(shape, str(root), scale, seed)
+                print(f"generated {shape} in {time.perf_counter() - t0:.1f}s", file=log)
+            for phase, fn in scenarios(root).items():
+                key = f"{shape}/{phase}"
+                if only and not any(fnmatch.fnmatch(key, p) for p in only):
+                    continue
+                r = results[key] = measure(fn, repeat)
+                print(f"{key:24} {r['entries']:>8} entries  {r['seconds'] * 1000:9.1f} ms  "
+                      f"{r['rate']:>12,.0f} /s  peak {r['peak_bytes'] / 1024:9.0f} KiB", file=log)
+    finally:
+        if tmp is not None:
+            shutil.rmtree(tmp, ignore_errors=True)
+    return results
+
+def compare(old, new, threshold=0.10, min_seconds=0.005, min_bytes=64 * 1024, out=sys.stdout):
+    # 速度は rate の低下、メモリは peak の増加が threshold を超えたら regression。
+    # どちらも min_seconds / min_bytes 未満の差はノイズとして見ない
+    regressions = 0
+    a, b = old["results"], new["results"]
+    for key in sorted(a.keys() & b.keys()):
+        ra, rb = a[key], b[key]
+        speed = rb["rate"] / ra["rate"] if ra["rate"] and rb["rate"] else 1.0
+        mem = rb["peak_bytes"] / ra["peak_bytes"] if ra["peak_bytes"] else 1.0
+        flags = []
+        if speed < 1 - threshold and max(ra["seconds"], rb["seconds"]) >= min_seconds:
+            flags.append("SLOWER")
+        if mem > 1 + threshold and rb["peak_bytes"] - ra["peak_bytes"] > min_bytes:
+            flags.append("MORE-MEMORY")
+        regressions += bool(flags)
+        print(f"{key:24} speed x{speed:5.2f}  memory x{mem:5.2f}  {' '.join(flags)}", file=out)
+    for side, keys in (("old", a.keys() - b.keys()), ("new", b.keys() - a.keys())):
+        if keys:
+            print(f"{len(keys)} scenario(s) only in {side}", file=out)
+    return regressions
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark fs_tree on reproducible synthetic trees (stdlib only).")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+
+    g = sub.add_parser("gen", help="generate a synthetic tree")
+    g.add_argument("shape", choices=SHAPES)
+    g.add_argument("dest")
+    g.add_argument("--scale", type=int, default=1)
+    g.add_argument("--seed", type=int, default=0)
+
+    r = sub.add_parser("run", help="run the timed scenarios and write a JSON results file")
+    r.add_argument("--shape", dest="shapes", action="append", choices=SHAPES, help="shape to run (repeatable, default: all)")
+    r.add_argument("--only", action="append", help="glob on 'shape/phase' (repeatable, e.g. '*/walk*')")
+    r.add_argument("--scale", type=int, default=1)
+    r.add_argument("--seed", type=int, default=0)
+    r.add_argument("--repeat", type=int, default=3, help="timed runs per scenario (best is kept)")
+    r.add_argument("--workdir", help="keep generated trees here and reuse them (default: temporary)")
+    r.add_argument("-o", "--output", default="bench.json", help="results file (default: bench.json)")
+
+    c = sub.add_parser("compare", help="compare two results files and flag regressions")
+    c.add_argument("old")
+    c.add_argument("new")
+    c.add_argument("--threshold", type=float, default=0.10, help="allowed relative slowdown / memory growth (default: 0.10)")
+    args = ap.parse_args()
+
+    if args.cmd == "gen":
+        if os.path.exists(args.dest) and os.listdir(args.dest):
+            print(f"Error: not empty: {args.dest}", file=sys.stderr)
+            sys.exit(2)
+        generate(args.shape, args.dest, args.scale, args.seed)
+        return
+    if args.cmd == "compare":
+        with open(args.old) as f:
+            old = json.load(f)
+        with open(args.new) as f:
+            new = json.load(f)
+        n = compare(old, new, args.threshold)
+        print(f"{n} regression(s)" if n else "no regressions")
+        sys.exit(1 if n else 0)
+
+    results = run(args.shapes or SHAPES, args.scale, args.seed, args.repeat, args.workdir, args.only)
+    meta = {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "scale": args.scale,
+        "seed": args.seed,
+        "repeat": args.repeat,
+    }
+    with open(args.output, "w") as f:
+        json.dump({"meta": meta, "results": results}, f, indent=2)
+        f.write("\n")
+    print(args.output)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+# coding: utf-8
+import argparse, dataclasses, html, json, os, sys
+
+from fs_tree import (IgnoreMatcher, Stat, Tree, TreeOptions, add_tree_arguments, build_tree, close_cache, human_size,
+                     open_cache, resolve_root)
+
+def load_snapshot(file: str):
+    # fs_tree.py --json の出力（fs_tree_batch の {"roots": [...]} ならルートが1つのもの）を Tree に読み込む。
+    # ディレクトリに "hash"（--merkle）がそろっていればそのまま使い、なければ読み込んだ属性から作り直す
+    with open(file, encoding="utf-8") as f:
+        data = json.load(f)
+    if "roots" in data:
+        if len(data["roots"]) != 1:
+            raise ValueError(f"{file}: batch snapshot has {len(data['roots'])} roots (need exactly 1)")
+        data = data["roots"][0]["tree"]
+    tree = Tree(data.get("name", ""), "", with_stat=True)
+    hashes = [data.get("hash")]
+    has_size = has_mtime = False
+    kids = data.get("children") or []
+    stack = [(ch, 0, k == len(kids) - 1) for k, ch in reversed(list(enumerate(kids)))]
+    while stack:
+        node, parent, is_last = stack.pop()
+        is_dir = node.get("type") == "dir"
+        size, mtime = node.get("size"), node.get("mtime")
+        has_size |= size is not None and not is_dir
+        has_mtime |= mtime is not None
+        series = node.get("series")
+        i = tree.add(parent, node["name"], Tree.DIR if is_dir else Tree.FILE, Tree.F_LAST if is_last else 0,
+                     node.get("symlink_to"), Stat(size or 0, (mtime or 0) * 1_000_000_000),
+                     tuple(series["members"]) if series else None)
+        if node.get("symlink_to") is not None:
+            tree.flags[i] |= Tree.F_SYMLINK
+        hashes.append(node.get("hash") if is_dir else "")
+        kids = node.get("children") or []
+        stack += [(ch, i, k == len(kids) - 1) for k, ch in reversed(list(enumerate(kids)))]
+    if all(h is not None for h in hashes):
+        tree.digest = [bytes.fromhex(h) for h in hashes]
+        tree.merkle_fields = (has_size, has_mtime)
+    else:
+        tree.merkle(has_size, has_mtime)
+    return tree
+
+def live_tree(path: str, opts: TreeOptions, fields):
+    root = resolve_root(path)
+    opts = dataclasses.replace(opts, size=fields[0], mtime=fields[1], merkle=True)
+    cache = open_cache(root, opts)
+    tree = build_tree(root, opts, IgnoreMatcher(opts.ignores, opts.show_hidden), cache=cache)
+    close_cache(cache)
+    return tree
+
+def children(tree: Tree):
+    # ディレクトリ -> {名前: ノード}
+    kids = {}
+    parent = tree.parent
+    for i in range(1, len(tree)):
+        kids.setdefault(parent[i], {})[tree.name_of(i)] = i
+    return kids
+
+def _count(kids, i):
+    # i の配下のエントリ数（追加・削除されたディレクトリの分だけ数えるので、差分の大きさに比例する）
+    n, stack = 0, [i]
+    while stack:
+        sub = kids.get(stack.pop(), {})
+        n += len(sub)
+        stack += sub.values()
+    return n
+
+def _attrs(tree: Tree, i: int, fields):
+    # ファイル同士の比較に使う属性（ハッシュに混ぜたものと同じ）
+    out = {}
+    if fields[0]:
+        out["size"] = tree.size[i]
+    if fields[1]:
+        out["mtime"] = tree.mtime[i] // 1_000_000_000
+    if i in tree.links:
+        out["symlink_to"] = tree.links[i]
+    if i in tree.series:
+        out["series"] = len(tree.series[i])
+    return out
+
+def diff_trees(a: Tree, b: Tree):
+    # 両方のルートから、ハッシュの違うディレクトリの組だけを降りていく。
+    # 戻り値は (変更の一覧, 降りたディレクトリの組の数)。変更は {"op", "path", "type", ...} でパス順
+    fields = tuple(x and y for x, y in zip(a.merkle_fields, b.merkle_fields))
+    for t in (a, b):
+        if t.merkle_fields != fields:
+            t.merkle(*fields)
+    ka, kb = children(a), children(b)
+    changes = []
+    visited = 0
+    stack = [(0, 0, "")]
+    while stack:
+        i, j, base = stack.pop()
+        if a.digest[i] == b.digest[j]:
+            continue
+        visited += 1
+        ca, cb = ka.get(i, {}), kb.get(j, {})
+        for name in ca.keys() | cb.keys():
+            path = base + name
+            x, y = ca.get(name), cb.get(name)
+            if y is None or x is None:
+                t, k, kids = (a, x, ka) if y is None else (b, y, kb)
+                rec = {"op": "removed" if y is None else "added", "path": path, "type": "dir" if t.kind[k] == Tree.DIR else "file"}
+                if t.kind[k] == Tree.DIR:
+                    rec["entries"] = _count(kids, k)
+                changes.append(rec)
+                continue
+            dir_a, dir_b = a.kind[x] == Tree.DIR, b.kind[y] == Tree.DIR
+            if dir_a and dir_b:
+                if a.links.get(x) != b.links.get(y):
+                    changes.append({"op": "changed", "path": path, "type": "dir",
+                                    "old": {"symlink_to": a.links.get(x)}, "new": {"symlink_to": b.links.get(y)}})
+                stack.append((x, y, path + "/"))
+                continue
+            old, new = _attrs(a, x, fields), _attrs(b, y, fields)
+            if dir_a != dir_b or old != new:
+                old["type"], new["type"] = ("dir" if dir_a else "file"), ("dir" if dir_b else "file")
+                changes.append({"op": "changed", "path": path, "type": new["type"],
+                                "old": {k: v for k, v in old.items() if new.get(k) != v},
+                                "new": {k: v for k, v in new.items() if old.get(k) != v}})
+    changes.sort(key=lambda c: c["path"].split("/"))
+    return changes, visited
+
+def _detail(c):
+    parts = []
+    for k in c["old"].keys() | c["new"].keys():
+        o, n = c["old"].get(k), c["new"].get(k)
+        if k == "size":
+            parts.append(f"size {human_size(o)} -> {human_size(n)}")
+        else:
+            parts.append(f"{k} {o} -> {n}")
+    return ", ".join(sorted(parts))
+
+MARK = {"added": "+", "removed": "-", "changed": "~"}
+
+def iter_text(changes, visited, total_dirs):
+    for c in changes:
+        line = f"{MARK[c['op']]} {c['path']}" + ("/" if c["type"] == "dir" else "")
+        if "entries" in c:
+            line += f"  ({c['entries']} entries)"
+        elif c["op"] == "changed":
+            line += "  " + _detail(c)
+        yield line
+    counts = {op: sum(1 for c in changes if c["op"] == op) for op in MARK}
+    yield (f"{counts['added']} added, {counts['removed']} removed, {counts['changed']} changed "
+           f"(descended into {visited} of {total_dirs} dirs)")
+
+def report_dict(changes, old_name, new_name):
+    out = {"old": old_name, "new": new_name, "added": [], "removed": [], "changed": []}
+    for c in changes:
+        out[c["op"]].append({k: v for k, v in c.items() if k != "op"})
+    return out
+
+HTML_HEAD = """<!doctype html>
+<html lang="ja">
+<head>
+<meta charset="utf-8" />
+<meta name="viewport" content="width=device-width, initial-scale=1" />
+<title>Tree diff</title>
+<style>
+  :root { --fg:#111; --muted:#666; --bg:#fff; --line:#ddd; --add:#1a7f37; --del:#cf222e; --mod:#9a6700; }
+  @media (prefers-color-scheme: dark) {
+    :root { --fg:#eee; --muted:#aaa; --bg:#0b0f17; --line:#2a2f3a; --add:#3fb950; --del:#f85149; --mod:#d29922; }
+  }
+  html,body{margin:0;padding:0;background:var(--bg);color:var(--fg);font:14px/1.5 system-ui,Segoe UI,Roboto,Helvetica,Arial,"Noto Sans JP",sans-serif}
+  header{border-bottom:1px solid var(--line);padding:10px 12px}
+  main{padding:12px}
+  ul{list-style:none;margin:0;padding-left:18px}
+  summary,li>span{font-family:ui-monospace,SFMono-Regular,Menlo,Consolas,monospace;cursor:default}
+  .added{color:var(--add)} .removed{color:var(--del);text-decoration:line-through} .changed{color:var(--mod)}
+  .muted{color:var(--muted);font-size:12px}
+</style>
+</head>
+<body>
+"""
+
+def write_html(f, changes, summary, old_name, new_name):
+    # 変更のあったパスだけを祖先つきの入れ子リストにする（JS なし、<details> で折りたたみ）
+    root = {}
+    for c in changes:
+        node = root
+        for p in c["path"].split("/")[:-1]:
+            node = node.setdefault(p, {})
+        node.setdefault("\0changes", []).append(c)
+
+    def emit(node):
+        f.write("<ul>")
+        for c in node.get("\0changes", ()):
+            name = html.escape(c["path"].rsplit("/", 1)[-1]) + ("/" if c["type"] == "dir" else "")
+            note = f"{c['entries']} entries" if "entries" in c else _detail(c) if c["op"] == "changed" else ""
+            f.write(f'<li><span class="{c["op"]}">{MARK[c["op"]]} {name}</span> <span class="muted">{html.escape(note)}</span></li>')
+        for name, sub in node.items():
+            if name == "\0changes":
+                continue
+            f.write(f"<li><details open><summary>{html.escape(name)}/</summary>")
+            emit(sub)
+            f.write("</details></li>")
+        f.write("</ul>")
+
+    f.write(HTML_HEAD)
+    f.write(f"<header><b>{html.escape(old_name)}</b> → <b>{html.escape(new_name)}</b>"
+            f' <span class="muted">{html.escape(summary)}</span></header>\n<main>')
+    emit(root)
+    f.write("</main>\n</body>\n</html>\n")
+
+def main():
+    ap = argparse.ArgumentParser(description="Compare two tree snapshots (fs_tree.py --json --merkle) or a snapshot and a live directory, "
+                                             "skipping every subtree whose hash matches.")
+    add_tree_arguments(ap, path=False)
+    ap.add_argument("old", help="snapshot JSON or directory")
+    ap.add_argument("new", help="snapshot JSON or directory")
+    ap.add_argument("--format", choices=("text", "json", "html"), default="text", help="output format (default: text)")
+    ap.add_argument("-o", "--output", help="output file (default: stdout)")
+    args = ap.parse_args()
+    opts = TreeOptions.from_args(args)
+
+    # スナップショットにある属性（サイズ・mtime）に合わせて、ライブ側も同じ属性でハッシュする
+    sides = [None, None]
+    fields = None
+    for k, arg in enumerate((args.old, args.new)):
+        if not os.path.isdir(arg):
+            try:
+                sides[k] = load_snapshot(arg)
+            except (OSError, ValueError, KeyError) as ex:
+                print(f"Error: cannot read snapshot {arg}: {ex}", file=sys.stderr)
+                sys.exit(2)
+            fields = sides[k].merkle_fields if fields is None else tuple(x and y for x, y in zip(fields, sides[k].merkle_fields))
+    if fields is None:
+        fields = (opts.size, opts.mtime)
+    for k, arg in enumerate((args.old, args.new)):
+        if sides[k] is None:
+            sides[k] = live_tree(arg, opts, fields)
+    a, b = sides
+
+    changes, visited = diff_trees(a, b)
+    total_dirs = sum(1 for k in b.kind if k == Tree.DIR)
+    out = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+    try:
+        if args.format == "json":
+            json.dump(report_dict(changes, args.old, args.new), out, ensure_ascii=False, indent=2)
+            out.write("\n")
+        elif args.format == "html":
+            *_, summary = iter_text(changes, visited, total_dirs)
+            write_html(out, changes, summary, args.old, args.new)
+        else:
+            for line in iter_text(changes, visited, total_dirs):
+                out.write(line + "\n")
+    except BrokenPipeError:
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, sys.stdout.fileno())
+        sys.exit(2)
+    if out is not sys.stdout:
+        out.close()
+        print(args.output, file=sys.stderr)
+    # diff(1) と同じく、違いがあれば 1
+    sys.exit(1 if changes else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# coding: utf-8
+import hashlib, json, mmap, os
+from concurrent.futures import ThreadPoolExecutor
+
+from fs_tree import Tree, human_size
+
+HEAD = 16 * 1024  # 先頭ブロックのハッシュで候補を絞る。これ以下のサイズなら先頭ハッシュ = 全体ハッシュ
+
+def head_hash(path: str):
+    try:
+        with open(path, "rb") as f:
+            return hashlib.blake2b(f.read(HEAD), digest_size=16).digest()
+    except OSError:
+        return None
+
+def full_hash(path: str):
+    # mmap をそのまま hashlib に渡す（大きな入力では GIL を外して計算されるのでスレッドで並列になる）
+    try:
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return hashlib.blake2b(mm, digest_size=16).digest()
+    except (OSError, ValueError):
+        return None
+
+def file_id(path: str):
+    # 実体の (st_dev, st_ino)。ハードリンクや --follow-symlinks でリンク先ディレクトリ越しに見えた同じファイルは同じ値になる
+    try:
+        st = os.stat(path)
+        return st.st_dev, st.st_ino
+    except OSError:
+        return None
+
+def _direct(path: str):
+    d = os.path.dirname(path)
+    return os.path.realpath(d) == d
+
+def _distinct(pool, groups, paths):
+    # 各サイズのグループから同じ実体のファイルを1つにまとめる。実体が2つ以上あるものだけ返す
+    ids = [i for _, g in groups for i in g]
+    keys = dict(zip(ids, pool.map(file_id, [paths[i] for i in ids])))
+    out = []
+    for size, g in groups:
+        seen = {}
+        for i in g:
+            k = keys[i]
+            if k is None:
+                continue
+            # 同じ実体なら、リンク先ディレクトリ越しでないパスを優先して残す（消してよい方として別名を出さない）
+            if k not in seen or (not _direct(paths[seen[k]]) and _direct(paths[i])):
+                seen[k] = i
+        if len(seen) > 1:
+            out.append((size, sorted(seen.values())))
+    return out
+
+def _memo(cache, path: str, stat, slot: int, fn):
+    # cache: path -> [stat, 先頭ハッシュ, 全体ハッシュ]。stat（サイズ, mtime）が変わっていなければ計算し直さない
+    rec = cache.get(path)
+    if rec is None or rec[0] != stat:
+        rec = cache[path] = [stat, None, None]
+    if rec[slot] is None:
+        rec[slot] = fn(path)
+    return rec[slot]
+
+def _regroup(pool, groups, fn):
+    # 各グループを fn(ノード番号) の値で分け直し、2件以上残ったものだけ返す（読めなかったファイルは外す）
+    ids = [i for _, g in groups for i in g]
+    keys = dict(zip(ids, pool.map(fn, ids)))
+    out = []
+    for size, g in groups:
+        sub = {}
+        for i in g:
+            k = keys[i]
+            if k is not None:
+                sub.setdefault(k, []).append(i)
+        out += [(size, k, ids) for k, ids in sub.items() if len(ids) > 1]
+    return out
+
+def find_dupes(tree: Tree, jobs=0, cache=None):
+    # 同じ内容のファイルのグループを tree.dupe_groups / tree.dupes に入れる。
+    # サイズ → 先頭 HEAD バイト → 全体の順に絞り込むので、サイズが一意なファイルは開きもしない。
+    # 空ファイル・シンボリックリンク・--series でまとめたノードは対象外。同じ実体（inode）へのパスは1つとして数えるので、
+    # ハードリンクや別名のパスが自分自身の重複として報告されることはない。
+    # cache（--watch の常駐キャッシュ）を渡すと、サイズと mtime が変わっていないファイルはハッシュし直さない
+    paths = tree.paths()
+    kind, flags, size, mtime, series = tree.kind, tree.flags, tree.size, tree.mtime, tree.series
+    if cache is None:
+        head = lambda i: head_hash(paths[i])
+        full = lambda i: full_hash(paths[i])
+    else:
+        head = lambda i: _memo(cache, paths[i], (size[i], mtime[i]), 1, head_hash)
+        full = lambda i: _memo(cache, paths[i], (size[i], mtime[i]), 2, full_hash)
+    by_size = {}
+    for i in range(1, len(tree)):
+        if kind[i] == Tree.FILE and not flags[i] & Tree.F_SYMLINK and size[i] > 0 and i not in series:
+            by_size.setdefault(size[i], []).append(i)
+    groups = [(s, g) for s, g in by_size.items() if len(g) > 1]
+    result = []
+    with ThreadPoolExecutor(jobs or None) as pool:
+        groups = _distinct(pool, groups, paths)
+        heads = _regroup(pool, groups, head)
+        result += [(s, d, g) for s, d, g in heads if s <= HEAD]
+        result += _regroup(pool, [(s, g) for s, _, g in heads if s > HEAD], full)
+    # 取り戻せるバイト数の多い順
+    result.sort(key=lambda r: (-r[0] * (len(r[2]) - 1), r[2][0]))
+    tree.dupe_groups = [(s, d.hex(), g) for s, d, g in result]
+    tree.dupes = {i: k for k, (_, _, g) in enumerate(tree.dupe_groups) for i in g}
+    return tree.dupe_groups
+
+def _relpaths(tree: Tree):
+    base = len(os.path.join(tree.path, ""))
+    return [p[base:] for p in tree.paths()]
+
+def iter_report_text(tree: Tree):
+    groups = tree.dupe_groups
+    rel = _relpaths(tree)
+    wasted = sum(s * (len(g) - 1) for s, _, g in groups)
+    yield f"{len(groups)} duplicate groups, {sum(len(g) - 1 for _, _, g in groups)} redundant files, {human_size(wasted)} reclaimable"
+    for k, (s, digest, g) in enumerate(groups):
+        yield f"\n[{k + 1}] {len(g)} x {human_size(s)}  ({human_size(s * (len(g) - 1))} reclaimable)  blake2b:{digest[:12]}"
+        for i in g:
+            yield "    " + rel[i]
+
+def report_dict(tree: Tree):
+    rel = _relpaths(tree)
+    groups = [{"size": s, "count": len(g), "reclaimable": s * (len(g) - 1), "hash": digest, "paths": [rel[i] for i in g]}
+              for s, digest, g in tree.dupe_groups]
+    return {"root": tree.path, "groups": groups, "reclaimable": sum(g["reclaimable"] for g in groups)}
+
+def iter_report_ndjson(tree: Tree):
+    for g in report_dict(tree)["groups"]:
+        yield json.dumps(g, ensure_ascii=False)
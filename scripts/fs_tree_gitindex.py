@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+# coding: utf-8
+import os, re, struct
+
+from fs_tree import Entry, Stat, scan_dir
+
+S_IFMT, S_IFDIR, S_IFLNK, S_IFGITLINK = 0o170000, 0o040000, 0o120000, 0o160000
+
+_HEADER = struct.Struct(">4sII")
+# ctime s/ns, mtime s/ns, dev, ino, mode, uid, gid, size
+_STAT = struct.Struct(">10I")
+
+def find_git_dir(path: str):
+    # (作業ツリーのトップ, git ディレクトリ)。.git がファイルなら "gitdir: ..." をたどる（worktree / submodule）
+    cur = os.path.abspath(path)
+    while True:
+        dot = os.path.join(cur, ".git")
+        if os.path.isdir(dot):
+            return cur, dot
+        if os.path.isfile(dot):
+            with open(dot, encoding="utf-8") as f:
+                line = f.readline().strip()
+            if line.startswith("gitdir:"):
+                return cur, os.path.normpath(os.path.join(cur, line[7:].strip()))
+        parent = os.path.dirname(cur)
+        if parent == cur:
+            return None
+        cur = parent
+
+def _varint(data, pos):
+    # index v4 のパス圧縮で使う可変長整数（git の offset 符号化）
+    c = data[pos]
+    pos += 1
+    val = c & 0x7F
+    while c & 0x80:
+        c = data[pos]
+        pos += 1
+        val = ((val + 1) << 7) | (c & 0x7F)
+    return val, pos
+
+def read_index(file: str, hash_len=20):
+    # .git/index (v2-v4) を1回の読み込みで解析し、ステージ 0 のエントリを (path, mode, size, mtime_ns) で返す。
+    # 競合中のパスは最初のステージだけを残す。split index は共有側を読めないので ValueError
+    with open(file, "rb") as f:
+        data = f.read()
+    sig, version, count = _HEADER.unpack_from(data, 0)
+    if sig != b"DIRC" or version not in (2, 3, 4):
+        raise ValueError(f"unsupported index: {sig!r} v{version}")
+    pos = _HEADER.size
+    out = []
+    prev = b""
+    last = None
+    for _ in range(count):
+        start = pos
+        st = _STAT.unpack_from(data, pos)
+        pos += _STAT.size + hash_len
+        flags, = struct.unpack_from(">H", data, pos)
+        pos += 2
+        if version >= 3 and flags & 0x4000:
+            pos += 2
+        if version == 4:
+            strip, pos = _varint(data, pos)
+            end = data.index(b"\0", pos)
+            name = prev[:len(prev) - strip] + data[pos:end]
+            pos = end + 1
+        else:
+            n = flags & 0xFFF
+            end = pos + n if n < 0xFFF else data.index(b"\0", pos)
+            name = data[pos:end]
+            # エントリ全体が 8 バイト境界になるよう 1〜8 個の NUL で埋められている
+            pos = start + ((end - start) // 8 + 1) * 8
+        prev = name
+        if name == last:
+            continue
+        last = name
+        out.append((os.fsdecode(name), st[6], st[9], st[2] * 1_000_000_000 + st[3]))
+    # 拡張（4 バイトの署名 + 長さ）。末尾の hash_len バイトはチェックサム
+    while pos + 8 <= len(data) - hash_len:
+        ext, size = struct.unpack_from(">4sI", data, pos)
+        if ext == b"link":
+            raise ValueError("split index is not supported")
+        pos += 8 + size
+    return out
+
+def _hash_len(git_dir: str):
+    try:
+        with open(os.path.join(git_dir, "config"), encoding="utf-8", errors="ignore") as f:
+            return 32 if re.search(r"(?im)^\s*objectformat\s*=\s*sha256\s*$", f.read()) else 20
+    except OSError:
+        return 20
+
+class GitIndexListing:
+    # ListingCache と同じ scan() で、ディレクトリ一覧を .git/index の追跡ファイルから作る（scandir しない）。
+    # untracked=True なら各ディレクトリを scandir して索引にないものを足す（除外は walk 側の ignore 規則がかける）
+    virtual = True
+
+    def __init__(self, root: str, untracked=False):
+        found = find_git_dir(root)
+        if found is None:
+            raise ValueError(f"not inside a git checkout: {root}")
+        top, git_dir = found
+        self.root = root
+        self.untracked = untracked
+        self.dirs = {root: {}}  # dir path -> {name: (mode, size, mtime_ns)}
+        prefix = os.path.relpath(root, top).replace(os.sep, "/")
+        prefix = "" if prefix == "." else prefix + "/"
+        dirs = self.dirs
+        for name, mode, size, mtime in read_index(os.path.join(git_dir, "index"), _hash_len(git_dir)):
+            if prefix:
+                if not name.startswith(prefix):
+                    continue
+                name = name[len(prefix):]
+            d = root
+            parts = name.rstrip("/").split("/")
+            for part in parts[:-1]:
+                listing = dirs[d]
+                d = os.path.join(d, part)
+                if part not in listing:
+                    listing[part] = (S_IFDIR, 0, 0)
+                    dirs[d] = {}
+            dirs[d][parts[-1]] = (mode, size, mtime)
+            if mode & S_IFMT == S_IFDIR:
+                # sparse index の畳まれたディレクトリ
+                dirs.setdefault(os.path.join(d, parts[-1]), {})
+
+    def scan(self, path: str, want_stat=False, stat_pool=None):
+        listing = self.dirs.get(path)
+        if listing is None:
+            # 索引にないディレクトリ（未追跡のディレクトリ、サブモジュールの中身）
+            return scan_dir(path, want_stat, stat_pool) if self.untracked and not self._gitlink(path) else []
+        entries = []
+        for name, (mode, size, mtime) in listing.items():
+            p = os.path.join(path, name)
+            kind = mode & S_IFMT
+            if kind == S_IFLNK:
+                try:
+                    link = os.readlink(p)
+                except OSError:
+                    link = "?"
+                is_dir = os.path.isdir(p)
+                entries.append(Entry(name, p, is_dir, not is_dir and os.path.isfile(p), True, link,
+                                     Stat(size, mtime) if want_stat else None))
+            elif kind in (S_IFDIR, S_IFGITLINK):
+                entries.append(Entry(name, p, True, False, False, None, None))
+            else:
+                entries.append(Entry(name, p, False, True, False, None, Stat(size, mtime) if want_stat else None))
+        if self.untracked:
+            try:
+                disk = scan_dir(path, want_stat, stat_pool)
+            except OSError:
+                disk = []
+            entries += [e for e in disk if e.name not in listing and e.name != ".git"]
+        return entries
+
+    def _gitlink(self, path: str):
+        parent = self.dirs.get(os.path.dirname(path))
+        return parent is not None and parent.get(os.path.basename(path), (0,))[0] & S_IFMT == S_IFGITLINK
@@ -1,35 +1,14 @@
 #!/usr/bin/env python3
 # coding: utf-8
-import argparse, json, subprocess, sys
+import argparse, base64, contextlib, gzip, json, os, re, sys
 from pathlib import Path
 
-def run_fs_tree_json(root, depth, ignores, show_hidden, dirs_only, files_only, limit_per_dir, follow_symlinks, relative):
-    here = Path(__file__).parent
-    fs_tree = here / "fs_tree.py"
-    if not fs_tree.exists():
-        print("Error: scripts/fs_tree.py が見つかりません。先に作成してください。", file=sys.stderr)
-        sys.exit(2)
-
-    cmd = [sys.executable, str(fs_tree), str(Path(root).resolve()), "--json"]
-    if depth is not None:
-        cmd += ["-d", str(depth)]
-    for ig in (ignores or []):
-        cmd += ["-I", ig]
-    if show_hidden:
-        cmd += ["--show-hidden"]
-    if dirs_only:
-        cmd += ["--dirs-only"]
-    if files_only:
-        cmd += ["--files-only"]
-    if limit_per_dir:
-        cmd += ["--limit-per-dir", str(limit_per_dir)]
-    if follow_symlinks:
-        cmd += ["--follow-symlinks"]
-    if relative:
-        cmd += ["--relative"]
-
-    out = subprocess.check_output(cmd)
-    return json.loads(out.decode("utf-8"))
+try:
+    from fs_tree import (IgnoreMatcher, TreeOptions, add_tree_arguments, build_tree, close_cache, close_stats, open_cache,
+                         open_stats, resolve_root, write_json)
+except ImportError:
+    print("Error: scripts/fs_tree.py が見つかりません。先に作成してください。", file=sys.stderr)
+    sys.exit(2)
 
 HTML_TMPL = """<!doctype html>
 <html lang="ja">
@@ -52,16 +31,15 @@ HTML_TMPL = """<!doctype html>
   @media (max-width: 980px){ main{grid-template-columns:1fr} #panel{order:-1} }
   .stats{color:var(--muted);font-size:12px}
   .tree{margin:10px 0 40px 0}
-  .tree ul{list-style:none;padding-left:20px;border-left:1px dashed var(--line)}
-  .tree li{margin:2px 0;white-space:nowrap;cursor:default}
+  .vspacer{position:relative}
+  .vrow{position:absolute;left:0;right:0;height:24px;white-space:nowrap;box-sizing:border-box}
+  .twisty{display:inline-block;width:12px;color:var(--muted)}
   .node{display:flex;align-items:center;gap:6px}
   .label{font-family:ui-monospace,SFMono-Regular,Menlo,Consolas,monospace}
   .dir>.label{font-weight:600}
   .file .ext{color:var(--muted);font-size:12px}
-  details{margin:2px 0}
-  details>summary{list-style:none;cursor:pointer}
-  summary::-webkit-details-marker{display:none}
   .hit{background:rgba(11,95,255,0.10);border-radius:6px}
+  .dupe{background:rgba(217,119,6,0.14);border-radius:6px}
   .muted{color:var(--muted)}
   #panel{border:1px solid var(--line);border-radius:12px;padding:12px}
   #panel h3{margin:0 0 8px 0;font-size:16px}
@@ -75,7 +53,8 @@ HTML_TMPL = """<!doctype html>
 <body>
 <header>
   <div class="row">
-    <input id="q" type="search" placeholder="フィルタ（例: app/law, *.tsx, api）" />
+    <select id="rootSel" class="btn" hidden></select>
+    <input id="q" type="search" placeholder="フィルタ（例: app/law/*.tsx, *.tsx, api）" />
     <button id="expand" class="btn">すべて展開</button>
     <button id="collapse" class="btn">すべて折りたたみ</button>
     <span id="stats" class="stats"></span>
@@ -94,17 +73,112 @@ HTML_TMPL = """<!doctype html>
     <div class="kv"><b>Path:</b> <span id="p_path"></span></div>
     <div class="kv"><b>Type:</b> <span id="p_type"></span></div>
     <div class="kv"><b>Ext:</b> <span id="p_ext"></span></div>
+    <div class="kv" id="p_size_row" hidden><b>Size:</b> <span id="p_size"></span></div>
+    <div class="kv" id="p_mtime_row" hidden><b>Modified:</b> <span id="p_mtime"></span></div>
+    <div class="kv" id="p_total_row" hidden><b>Total:</b> <span id="p_total"></span></div>
+    <div class="kv" id="p_lines_row" hidden><b>Lines:</b> <span id="p_lines"></span></div>
+    <div class="kv" id="p_series_row" hidden><b>Series:</b> <span id="p_series"></span></div>
+    <div class="kv" id="p_dupe_row" hidden><b>Duplicates:</b> <span id="p_dupe"></span></div>
   </aside>
 </main>
+<script type="text/js-worker" id="searchWorker">
+  // 検索インデックス上の絞り込み（Web Worker とメインスレッドのフォールバックで共用）
+  function globRegex(q){
+    // '/' を含むクエリはパスのグロブ: * はセグメント内、** は階層をまたぐ、? は1文字
+    let re = '';
+    for(let i = 0; i < q.length; i++){
+      const c = q[i];
+      if(c === '*'){
+        if(q[i+1] === '*' && q[i+2] === '/'){ re += '(.*/)?'; i += 2; }
+        else if(q[i+1] === '*'){ re += '.*'; i++; }
+        else re += '[^/]*';
+      } else if(c === '?') re += '[^/]';
+      else re += c.replace(/[.+^${}()|[\\]\\\\]/g, '\\\\$&');
+    }
+    return new RegExp('(^|/)' + re + '$');
+  }
+
+  function fragMatch(frags, text){
+    let pos = 0;
+    for(const f of frags){
+      const i = text.indexOf(f, pos);
+      if(i < 0) return false;
+      pos = i + f.length;
+    }
+    return true;
+  }
+
+  function intersect(a, b){
+    const out = [];
+    let i = 0, j = 0;
+    while(i < a.length && j < b.length){
+      if(a[i] === b[j]){ out.push(a[i]); i++; j++; }
+      else if(a[i] < b[j]) i++;
+      else j++;
+    }
+    return out;
+  }
+
+  function candidates(index, lit){
+    // 名前の trigram の posting を交差させて候補 id を絞る（3文字未満なら null = 全件）
+    if(lit.length < 3) return null;
+    let cur = null;
+    for(let i = 0; i + 3 <= lit.length; i++){
+      const post = index.tri[lit.slice(i, i+3)];
+      if(!post) return [];
+      cur = cur === null ? post : intersect(cur, post);
+      if(!cur.length) break;
+    }
+    return cur;
+  }
+
+  function search(index, q){
+    q = q.trim().toLowerCase();
+    if(q.endsWith('/')) q += '**';
+    const paths = index.paths;
+    let test;
+    if(q.includes('/')){
+      const re = globRegex(q);
+      test = p => re.test(p);
+    } else {
+      const frags = q.split('*').filter(Boolean);
+      test = p => fragMatch(frags, p.slice(p.lastIndexOf('/') + 1));
+    }
+    // 最後のセグメント（= ノード名）に必ず含まれる最長のリテラルで候補を絞る
+    const lits = q.split('/').pop().split(/[*?]/).filter(Boolean).sort((a, b)=>b.length - a.length);
+    const cand = lits.length ? candidates(index, lits[0]) : null;
+    const hits = [];
+    if(cand){
+      for(const id of cand) if(test(paths[id])) hits.push(id);
+    } else {
+      for(let id = 1; id < paths.length; id++) if(test(paths[id])) hits.push(id);
+    }
+    return hits;
+  }
+
+  if(typeof importScripts === 'function'){
+    let INDEX = null;
+    self.onmessage = (e)=>{
+      if(e.data.index){ INDEX = e.data.index; return; }
+      const hits = Int32Array.from(search(INDEX, e.data.q));
+      self.postMessage({seq: e.data.seq, hits}, [hits.buffer]);
+    };
+  }
+</script>
 <script>
-  const DATA = __DATA_JSON__;
-  const ROOT_LABEL = DATA.name || "repo";
+  // 埋め込みデータ。format が json 以外なら列形式（gzip はさらに base64）で、boot() が DATA / INDEX に展開する
+  const PAYLOAD = {format: __FORMAT_JSON__, data: __DATA_JSON__, index: __INDEX_JSON__};
+  // 複数ルートをまとめたページでは DATA 直下の子が各ルート（ROOTS はその元のパス）
+  const ROOTS = __ROOTS_JSON__;
+  // --serve: データは埋め込まず、開いたディレクトリの子・検索・ファイル情報をサーバーに問い合わせる
+  const SERVE = PAYLOAD.format === 'serve';
+  let DATA = null, INDEX = null;
+  let VIEW = 0, VIEW_END = 0;  // 表示中のルートの id と、その配下の id の終わり（先行順なので連続）
 
   const $tree = document.getElementById('tree');
   const $q = document.getElementById('q');
   const $stats = document.getElementById('stats');
   const $rootName = document.getElementById('rootName');
-  $rootName.textContent = "Root: " + ROOT_LABEL;
 
   const $pName = document.getElementById('p_name');
   const $pRole = document.getElementById('p_role');
@@ -113,6 +187,53 @@ HTML_TMPL = """<!doctype html>
   const $pType = document.getElementById('p_type');
   const $pExt  = document.getElementById('p_ext');
 
+  function humanSize(n){
+    const units = ['B','K','M','G','T'];
+    let i = 0;
+    while(n >= 1024 && i < units.length-1){ n /= 1024; i++; }
+    return i ? n.toFixed(1)+units[i] : n+'B';
+  }
+
+  // --loc の行数。ディレクトリは言語ごとの内訳も付ける
+  function linesText(node){
+    if(!node || node.lines == null) return null;
+    let s = node.lines.toLocaleString()+' lines';
+    if(node.language) s += ' ('+node.language+')';
+    const langs = node.languages ? Object.entries(node.languages) : [];
+    if(langs.length && node.lines) s += ' — ' + langs.map(([k, v]) => k+' '+(v*100/node.lines).toFixed(1)+'%').join(', ');
+    return s;
+  }
+
+  // --dupes: 同じグループのファイル（グループ番号 -> id の一覧は初回に1度だけ作る）
+  let DUPES = null;
+  function dupeText(node){
+    if(!node || node.dupe == null) return null;
+    if(!DUPES){
+      DUPES = {};
+      for(let i = 0; i < NODES.length; i++) if(NODES[i].dupe != null) (DUPES[NODES[i].dupe] = DUPES[NODES[i].dupe] || []).push(i);
+    }
+    const ids = DUPES[node.dupe];
+    let s = '#'+(node.dupe+1)+', '+ids.length+' copies';
+    if(node.size != null) s += ', '+humanSize(node.size*(ids.length-1))+' reclaimable';
+    return s + ' — ' + ids.filter(i => NODES[i] !== node).map(pathOf).join(', ');
+  }
+
+  // --size / --mtime / --rollup / --loc / --dupes の値（あれば）を右ペインに出す
+  function showMeta(node){
+    const rows = [
+      ['p_size', node && node.size != null ? humanSize(node.size)+' ('+node.size.toLocaleString()+' bytes)' : null],
+      ['p_mtime', node && node.mtime != null ? new Date(node.mtime*1000).toLocaleString() : null],
+      ['p_total', node && node.total_size != null ? humanSize(node.total_size)+' / '+node.files+' files' : null],
+      ['p_lines', linesText(node)],
+      ['p_dupe', dupeText(node)],
+      ['p_series', node && node.series ? node.series.count+' versions, oldest '+node.series.oldest+', newest '+node.series.newest : null],
+    ];
+    for(const [id, text] of rows){
+      document.getElementById(id+'_row').hidden = text == null;
+      document.getElementById(id).textContent = text || '';
+    }
+  }
+
   function icon(node){
     if(node.type === 'dir') return "📁";
     const n = (node.name||"").toLowerCase();
@@ -217,48 +338,171 @@ HTML_TMPL = """<!doctype html>
     return ['ファイル', ''];
   }
 
-  function build(node, basePath){
-    // basePath: 親までの相対パス
-    if(node.type === 'dir'){
-      const det = document.createElement('details');
-      const sum = document.createElement('summary');
-      const path = basePath ? (basePath + '/' + node.name) : node.name;
-      sum.innerHTML = '<span class="node dir clickable"><span>'+icon(node)+'</span><span class="label">'+escapeHtml(node.name)+'/</span><span class="muted">'+(node.children?.length||0)+'項目</span></span>';
-      sum.dataset.path = path;
-      sum.onclick = (e)=>{ e.stopPropagation(); select(path, true); };
-      det.appendChild(sum);
-      const ul = document.createElement('ul');
-      (node.children||[]).sort((a,b)=>{
-        const da = (a.type==='dir')?0:1, db = (b.type==='dir')?0:1;
-        if(da!==db) return da-db;
-        return a.name.localeCompare(b.name, 'ja');
-      }).forEach(ch=>{
-        ul.appendChild(buildItem(ch, path));
-      });
-      det.appendChild(ul);
-      return det;
+  // ===== 仮想スクロールのツリー =====
+  // 開いているフォルダの子だけを並べたフラットな行配列を持ち、DOM はビューポート付近の行だけ作る。
+  // 子の並び順は Python 側で決めてあるので、ここでは並べ替えない
+  const ROW_H = 24, OVERSCAN = 20;
+  let rows = [];          // {node, depth, path}。検索結果の表示中は {node, id, hit: true}
+  let selectedPath = null;
+
+  // INDEX の id（Python 側と同じ先行順）→ ノード・親 id
+  let NODES = [], PARENT = [];
+  function flatten(){
+    const stack = [[DATA, -1]];
+    while(stack.length){
+      const [node, parent] = stack.pop();
+      const id = NODES.length;
+      NODES.push(node);
+      PARENT.push(parent);
+      const kids = node.children || [];
+      for(let k = kids.length - 1; k >= 0; k--) stack.push([kids[k], id]);
+    }
+  }
+
+  // 列形式のペイロード → ノードの木と INDEX。ノードは先行順に並んでいて、up[i] は親までの距離
+  function unpackCompact(c){
+    const s = c.strings, n = c.kind.length, paths = new Array(n);
+    NODES = new Array(n);
+    PARENT = new Array(n);
+    for(let i = 0; i < n; i++){
+      const isDir = c.kind[i] === 0;
+      const node = {name: s[c.stem[i]] + s[c.ext[i]], type: isDir ? 'dir' : 'file'};
+      if(c.link && c.link[i] != null) node.symlink_to = c.link[i];
+      if(c.size && !isDir) node.size = c.size[i];
+      if(c.mtime && i) node.mtime = c.mtime[i];
+      if(c.total && isDir){ node.total_size = c.total[i]; node.files = c.files[i]; }
+      if(c.dupe && c.dupe[i] != null) node.dupe = c.dupe[i];
+      if(c.series && c.series[i]){
+        const m = c.series[i];
+        node.series = {count: m.length, oldest: m[0], newest: m[m.length-1], members: m};
+      }
+      if(c.lines && c.lines[i] >= 0){
+        node.lines = c.lines[i];
+        if(isDir) node.languages = c.langs[i] || {};
+        else node.language = s[c.lang[i]];
+      }
+      if(isDir) node.children = [];
+      NODES[i] = node;
+      if(i === 0){ PARENT[0] = -1; paths[0] = ''; continue; }
+      const p = PARENT[i] = i - c.up[i];
+      NODES[p].children.push(node);
+      paths[i] = (p ? paths[p] + '/' : '') + node.name.toLowerCase();
+    }
+    // posting は差分で入っている
+    const tri = {};
+    for(const t in c.tri){
+      const d = c.tri[t], ids = new Array(d.length);
+      for(let k = 0, v = 0; k < d.length; k++) ids[k] = v += d[k];
+      tri[t] = ids;
+    }
+    DATA = NODES[0];
+    INDEX = {paths, tri};
+  }
+
+  async function gunzipJson(b64){
+    const bin = Uint8Array.from(atob(b64), ch=>ch.charCodeAt(0));
+    const stream = new Blob([bin]).stream().pipeThrough(new DecompressionStream('gzip'));
+    return JSON.parse(await new Response(stream).text());
+  }
+
+  // --serve: ディレクトリの子を初めて開くときに取ってくる（読めなければ空）
+  async function loadChildren(node, path){
+    try {
+      const res = await fetch('api/children?path=' + encodeURIComponent(path));
+      node.children = res.ok ? (await res.json()).children : [];
+    } catch(e) {
+      node.children = [];
+    }
+  }
+
+  function pathOf(id){
+    const parts = [];
+    for(; id > VIEW; id = PARENT[id]) parts.push(NODES[id].name);
+    return parts.reverse().join('/');
+  }
+
+  const $spacer = document.createElement('div');
+  $spacer.className = 'vspacer';
+  const $win = document.createElement('div');
+  $spacer.appendChild($win);
+  $tree.appendChild($spacer);
+
+  function childPath(base, node){
+    return base ? base + '/' + node.name : node.name;
+  }
+
+  function expandRows(node, depth, base, out){
+    for(const ch of (node.children||[])){
+      const path = childPath(base, ch);
+      out.push({node: ch, depth, path});
+      // グループのメンバーは同じディレクトリにあるので、パスの基点は親のまま
+      if((ch.type === 'dir' || ch.series) && ch._open) expandRows(ch, depth+1, ch.series ? base : path, out);
+    }
+    return out;
+  }
+
+  function toggle(i){
+    const row = rows[i];
+    if(row.node._open){
+      let j = i + 1;
+      while(j < rows.length && rows[j].depth > row.depth) j++;
+      rows = rows.slice(0, i+1).concat(rows.slice(j));
+      row.node._open = false;
+    } else if(SERVE && row.node.type === 'dir' && !row.node.children){
+      // 読み込みの間に行が動いても、同じ行を探し直して開く
+      loadChildren(row.node, row.path).then(()=>{ const k = rows.indexOf(row); if(k >= 0 && !row.node._open) toggle(k); });
+      return;
     } else {
-      return buildItem(node, basePath);
+      // --series のグループはメンバーの行を開いたときに初めて作る
+      if(row.node.series && !row.node.children) row.node.children = row.node.series.members.map(name => ({name, type: 'file'}));
+      row.node._open = true;
+      const base = row.node.series ? row.path.slice(0, Math.max(0, row.path.lastIndexOf('/'))) : row.path;
+      rows = rows.slice(0, i+1).concat(expandRows(row.node, row.depth+1, base, []), rows.slice(i+1));
     }
+    layout();
   }
 
-  function buildItem(node, basePath){
-    const path = basePath ? (basePath + '/' + node.name) : node.name;
-    if(node.type === 'dir'){
-      const li = document.createElement('li');
-      const det = build(node, path);
-      li.appendChild(det);
-      return li;
+  function rowHtml(row, i){
+    const n = row.node, isDir = n.type === 'dir', isGroup = !!n.series;
+    if(row.hit){
+      // 検索結果はフルパスで1行ずつ（パスは描画する行の分だけ親をたどって作る）
+      return '<div class="vrow node clickable hit '+(isDir ? 'dir' : 'file')+'" data-i="'+i+'" style="top:'+(i*ROW_H)+'px">'
+        + '<span>'+icon(n)+'</span><span class="label">'+escapeHtml(row.path != null ? row.path : pathOf(row.id))+(isDir ? '/' : '')+'</span></div>';
     }
-    const li = document.createElement('li');
-    li.className = 'file';
-    const span = document.createElement('span');
-    span.className = 'node clickable';
-    span.dataset.path = path;
-    span.onclick = (e)=>{ e.stopPropagation(); select(path, false, li); };
-    span.innerHTML = '<span>'+icon(node)+'</span><span class="label">'+escapeHtml(node.name)+'</span>'+extBadge(node.name);
-    li.appendChild(span);
-    return li;
+    const cls = 'vrow node clickable ' + (isDir ? 'dir' : 'file')
+      + (n.dupe != null ? ' dupe' : '') + (row.path === selectedPath ? ' selected' : '');
+    let html = '<span class="twisty">'+(isDir || isGroup ? (n._open ? '▾' : '▸') : '')+'</span>'
+      + '<span>'+icon(n)+'</span><span class="label">'+escapeHtml(n.name)+(isDir ? '/' : '')+'</span>';
+    html += isDir ? '<span class="muted">'+(n.children ? n.children.length+'項目' : '')+'</span>'
+      : isGroup ? '<span class="muted">'+n.series.count+'件</span>' : extBadge(n.name);
+    return '<div class="'+cls+'" data-i="'+i+'" style="top:'+(i*ROW_H)+'px;padding-left:'+(row.depth*18)+'px">'+html+'</div>';
+  }
+
+  let raf = 0;
+  function paint(){
+    raf = 0;
+    const top = $spacer.getBoundingClientRect().top;
+    const first = Math.max(0, Math.floor(-top / ROW_H) - OVERSCAN);
+    const last = Math.min(rows.length, Math.ceil((window.innerHeight - top) / ROW_H) + OVERSCAN);
+    let html = '';
+    for(let i = first; i < last; i++) html += rowHtml(rows[i], i);
+    $win.innerHTML = html;
+  }
+
+  function schedule(){
+    if(!raf) raf = requestAnimationFrame(paint);
+  }
+
+  function layout(){
+    $spacer.style.height = (rows.length * ROW_H) + 'px';
+    schedule();
+  }
+
+  function setOpen(node, open){
+    // --serve では読み込み済みのディレクトリだけを開く
+    if(node.type !== 'dir' || (open && !node.children)) return;
+    node._open = open;
+    (node.children||[]).forEach(ch=>setOpen(ch, open));
   }
 
   function extBadge(name){
@@ -272,10 +516,13 @@ HTML_TMPL = """<!doctype html>
     return s.replace(/[&<>"']/g, m=>({ '&':'&amp;','<':'&lt;','>':'&gt;','"':'&quot;',"'":'&#39;' }[m]));
   }
 
+  let statsText = '';
   function render(){
-    $tree.innerHTML = '';
-    $tree.appendChild(build(DATA, ''));
-    $stats.textContent = countStats(DATA);
+    NODES[VIEW]._open = true;
+    rows = expandRows(NODES[VIEW], 0, '', []);
+    layout();
+    // 件数の集計は初回描画の後に回す
+    setTimeout(()=>{ statsText = countStats(NODES[VIEW]); if(!query) $stats.textContent = statsText; }, 0);
   }
 
   function countStats(node){
@@ -287,68 +534,92 @@ HTML_TMPL = """<!doctype html>
       } else files++;
     }
     walk(node);
-    return `dirs: ${dirs-1}, files: ${files}`;
+    return `dirs: ${dirs-1}, files: ${files}` + (SERVE ? ' (loaded)' : '');
   }
 
-  function match(glob, text){
-    if(!glob) return true;
-    glob = glob.toLowerCase();
-    text = text.toLowerCase();
-    const parts = glob.split('*');
-    let pos = 0;
-    for(const p of parts){
-      if(!p) continue;
-      const i = text.indexOf(p, pos);
-      if(i<0) return false;
-      pos = i + p.length;
+  // ===== 検索（INDEX を Worker に渡し、ヒットした id だけ受け取る） =====
+  const searchSrc = document.getElementById('searchWorker').textContent;
+  let worker = null, localSearch = null, seq = 0, query = '';
+  function startSearch(){
+    try {
+      worker = new Worker(URL.createObjectURL(new Blob([searchSrc], {type: 'text/javascript'})));
+      worker.onmessage = (e)=>{ if(e.data.seq === seq) showHits(e.data.hits); };
+      worker.postMessage({index: INDEX});
+    } catch(e) {
+      worker = null;
     }
-    return true;
   }
 
-  function filterTree(q){
-    const glob = q.trim();
-    let hits = 0;
-
-    function recurse(el){
-      if(el.tagName==='DETAILS'){
-        const sum = el.querySelector(':scope > summary .label');
-        const name = sum?.textContent || '';
-        const ul = el.querySelector(':scope > ul');
-        let childHit = 0;
-        ul.querySelectorAll(':scope > li').forEach(li=>{
-          const h = recurse(li);
-          childHit += h;
-          li.style.display = h ? '' : 'none';
-        });
-        const selfHit = match(glob, name);
-        const hit = selfHit || childHit>0;
-        sum?.classList.toggle('hit', selfHit && glob);
-        el.style.display = hit ? '' : 'none';
-        el.open = hit && glob ? true : el.open;
-        hits += hit ? 1 : 0;
-        return hit ? 1 : 0;
-      } else if(el.tagName==='LI'){
-        const lab = el.querySelector(':scope .label');
-        const name = lab?.textContent || '';
-        const isHit = match(glob, name);
-        lab?.classList.toggle('hit', isHit && glob);
-        hits += isHit ? 1 : 0;
-        return isHit ? 1 : 0;
-      }
-      return 0;
+  function runSearch(q){
+    if(!DATA) return;
+    query = q.trim();
+    seq++;
+    if(!query){ showTree(); return; }
+    if(SERVE){ searchServer(query, seq); return; }
+    if(worker){ worker.postMessage({seq, q: query}); return; }
+    if(!localSearch) localSearch = new Function(searchSrc + '\\nreturn search;')();
+    showHits(localSearch(INDEX, query));
+  }
+
+  function showTree(){
+    rows = expandRows(NODES[VIEW], 0, '', []);
+    layout();
+    $stats.textContent = statsText;
+  }
+
+  function showHits(hits){
+    if(VIEW) hits = hits.filter(id => id > VIEW && id < VIEW_END);
+    rows = new Array(hits.length);
+    for(let k = 0; k < hits.length; k++) rows[k] = {node: NODES[hits[k]], id: hits[k], hit: true};
+    layout();
+    $stats.textContent = statsText + ` | hits: ${hits.length}`;
+  }
+
+  // --serve: サーバー側で一覧をたどって探す（結果はパスで来る）
+  async function searchServer(q, s){
+    let data = {hits: [], truncated: false};
+    try {
+      const res = await fetch('api/search?q=' + encodeURIComponent(q));
+      if(res.ok) data = await res.json();
+    } catch(e) {}
+    if(s !== seq) return;
+    rows = data.hits.map(h => ({node: {name: h.path.split('/').pop(), type: h.type}, path: h.path, hit: true}));
+    layout();
+    $stats.textContent = statsText + ` | hits: ${rows.length}` + (data.truncated ? '+' : '');
+  }
+
+  // 検索結果のクリック: 祖先を開いてツリー表示に戻し、その行までスクロール
+  function reveal(id){
+    for(let p = PARENT[id]; p > VIEW; p = PARENT[p]) NODES[p]._open = true;
+    showNode(NODES[id]);
+  }
+
+  // --serve: 祖先を上から順に読み込んで開く。見つかったノード（なければ null）を返す
+  async function revealPath(path){
+    let node = DATA, base = '';
+    for(const name of path.split('/')){
+      if(!node.children) await loadChildren(node, base);
+      node._open = true;
+      node = node.children.find(ch => ch.name === name);
+      if(!node) break;
+      base = base ? base + '/' + name : name;
     }
+    showNode(node);
+    return node || null;
+  }
 
-    const top = $tree.firstElementChild;
-    if(!top) return;
-    recurse(top);
-    $stats.textContent = countStats(DATA) + (glob ? ` | hits: ${hits}` : '');
+  function showNode(node){
+    $q.value = '';
+    query = '';
+    showTree();
+    const i = rows.findIndex(r=>r.node === node);
+    if(i >= 0) window.scrollTo(0, $spacer.getBoundingClientRect().top + window.scrollY + i*ROW_H - window.innerHeight/2);
   }
 
   // 選択して右ペインへ反映
-  let lastSel;
-  function select(path, isDir, liElem){
-    if(lastSel) lastSel.classList.remove('selected');
-    if(liElem) { liElem.classList.add('selected'); lastSel = liElem; }
+  function select(path, isDir, node){
+    selectedPath = path;
+    schedule();
     const name = path.split('/').pop() || path;
     const ext = (name.includes('.') ? name.split('.').pop() : '');
     const [role, desc] = roleInfo(path, isDir);
@@ -358,56 +629,282 @@ HTML_TMPL = """<!doctype html>
     $pPath.textContent = path;
     $pType.textContent = isDir ? 'directory' : 'file';
     $pExt.textContent = isDir ? '-' : (ext || '(none)');
+    showMeta(node);
+    // --serve: 一覧の値をすぐ出してから、最新の属性（サイズ・mtime・行数）で置き換える
+    if(SERVE && !(node && node.series)){
+      fetch('api/meta?path=' + encodeURIComponent(path)).then(r => r.ok ? r.json() : null)
+        .then(m => { if(m && selectedPath === path) showMeta(Object.assign({}, node, m)); }, ()=>{});
+    }
+  }
+
+  // 初期描画（gzip ペイロードは展開を待ってから）
+  async function boot(){
+    if(SERVE){
+      DATA = {name: PAYLOAD.data.name, type: 'dir'};
+      NODES = [DATA];
+      PARENT = [-1];
+      await loadChildren(DATA, '');
+    } else if(PAYLOAD.format === 'json'){
+      DATA = PAYLOAD.data;
+      INDEX = PAYLOAD.index;
+      flatten();
+    } else {
+      unpackCompact(PAYLOAD.format === 'gzip' ? await gunzipJson(PAYLOAD.data) : PAYLOAD.data);
+    }
+    VIEW_END = NODES.length;
+    $rootName.textContent = "Root: " + (DATA.name || "repo");
+    if(ROOTS) initRoots();
+    if(INDEX || !SERVE) startSearch();
+    render();
+    if($q.value.trim()) runSearch($q.value);
   }
 
-  // 初期描画
-  render();
+  // ルート選択: ツリーと検索結果をそのルートの配下に絞る（パスもそのルートからの相対になる）
+  function initRoots(){
+    const $sel = document.getElementById('rootSel');
+    const ids = [];
+    for(let id = 1; id < NODES.length; id++) if(PARENT[id] === 0) ids.push(id);
+    $sel.innerHTML = '<option value="0">すべてのルート ('+ids.length+')</option>'
+      + ids.map((id, k)=>'<option value="'+id+'">'+escapeHtml(NODES[id].name)+'</option>').join('');
+    $sel.hidden = false;
+    $rootName.textContent = ids.length + " roots";
+    $sel.addEventListener('change', ()=>{
+      VIEW = +$sel.value;
+      const k = ids.indexOf(VIEW);
+      VIEW_END = VIEW && k + 1 < ids.length ? ids[k + 1] : NODES.length;
+      $rootName.textContent = VIEW ? "Root: " + ROOTS[k] : ids.length + " roots";
+      selectedPath = null;
+      statsText = countStats(NODES[VIEW]);
+      render();
+      if(query) runSearch(query);
+    });
+  }
+  boot();
 
   // コントロール
+  window.addEventListener('scroll', schedule, {passive: true});
+  window.addEventListener('resize', schedule);
+  $win.addEventListener('click', (e)=>{
+    const el = e.target.closest('.vrow');
+    if(!el) return;
+    const i = +el.dataset.i, row = rows[i], isDir = row.node.type === 'dir';
+    if(row.hit && SERVE){
+      revealPath(row.path).then(node => select(row.path, isDir, node || row.node));
+      return;
+    }
+    if(row.hit){
+      const path = pathOf(row.id);
+      reveal(row.id);
+      select(path, isDir, row.node);
+      return;
+    }
+    if(isDir || row.node.series) toggle(i);
+    select(row.path, isDir, row.node);
+  });
   document.getElementById('expand').onclick = ()=> {
-    $tree.querySelectorAll('details').forEach(d=>d.open = true);
+    if(!DATA) return;
+    setOpen(NODES[VIEW], true);
+    if(!query) showTree();
   };
   document.getElementById('collapse').onclick = ()=> {
-    $tree.querySelectorAll('details').forEach(d=>d.open = false);
+    if(!DATA) return;
+    setOpen(NODES[VIEW], false);
+    if(!query) showTree();
   };
   let t=null;
   $q.addEventListener('input', ()=>{
-    clearTimeout(t); t=setTimeout(()=>filterTree($q.value), 120);
+    clearTimeout(t); t=setTimeout(()=>runSearch($q.value), 30);
   });
 </script>
 </body>
 </html>
 """
 
+def tmp_path(out: Path):
+    return out.with_name(out.name + ".tmp")
+
+def build_index(tree, sort="name"):
+    # 検索用: 先行順 id ごとの小文字の相対パスと、名前の trigram → id の posting（id 昇順）
+    base = len(os.path.join(tree.path, ""))
+    paths = [""]
+    tri = {}
+    for kind, e, _, _, _ in tree.items(sort):
+        if kind == "perm":
+            continue
+        i = len(paths)
+        paths.append(e.path[base:].lower())
+        name = e.name.lower()
+        for t in {name[k:k + 3] for k in range(len(name) - 2)}:
+            tri.setdefault(t, []).append(i)
+    return {"paths": paths, "tri": tri}
+
+class ScriptWriter:
+    # <script> に埋め込む JSON 中の "</" でタグが閉じないようにする
+    def __init__(self, f):
+        self.f = f
+
+    def write(self, s):
+        self.f.write(s.replace("</", "<\\/"))
+
+def shell_html(name: str):
+    # --serve 用: データを埋め込まない外枠（子・検索・ファイル情報は fs_tree_serve の API から取る）
+    fill = {"FORMAT": json.dumps("serve"), "DATA": json.dumps({"name": name}, ensure_ascii=False).replace("</", "<\\/"),
+            "INDEX": "null", "ROOTS": "null"}
+    parts = re.split(r"__([A-Z]+)_JSON__", HTML_TMPL)
+    return "".join(fill[part] if i % 2 else part for i, part in enumerate(parts))
+
+def compact_payload(tree, cols=(), sort="name"):
+    # 列形式: 名前は stem と拡張子に分けて文字列表へ intern し、種別・親は整数列にする。
+    # 親は「何個前のノードか」、trigram の posting は差分で持つ（どちらも小さい数になり gzip が効く）。
+    # INDEX の paths は名前と親から組み直せるので入れない
+    strings, ids = [], {}
+
+    def intern(s):
+        i = ids.get(s)
+        if i is None:
+            i = ids[s] = len(strings)
+            strings.append(s)
+        return i
+
+    with_size = "size" in cols and tree.size is not None
+    with_mtime = "mtime" in cols and tree.size is not None
+    with_total = "rollup" in cols and tree.total is not None
+    with_lines = "loc" in cols and tree.lines is not None
+    with_dupes = "dupes" in cols and tree.dupes is not None
+    stem, ext = os.path.splitext(tree.name_of(0))
+    out = {"strings": strings, "stem": [intern(stem)], "ext": [intern(ext)], "up": [0], "kind": [0], "link": {}}
+    if with_dupes:
+        out["dupe"] = {}  # 疎: ノード -> 重複グループ番号
+    if tree.series:
+        out["series"] = {}  # 疎: ノード -> メンバー名の一覧
+    size, mtime, total, files = [0], [0], [0], [0]
+    # 行数は数えていないファイルを -1、言語は文字列表の id、ディレクトリの内訳は疎な dict
+    lines, lang, langs = [-1], [-1], {}
+    root = tree.root()
+    if with_total:
+        total[0], files[0] = root.total, root.files
+    if with_lines and root.lines is not None:
+        lines[0], langs[0] = root.lines, root.language
+    stack = [0]  # 深さごとの直近ノードの id
+    for kind, e, depth, _, _ in tree.items(sort):
+        if kind == "perm":
+            continue
+        i = len(out["kind"])
+        del stack[depth:]
+        stem, ext = os.path.splitext(e.name)
+        out["stem"].append(intern(stem))
+        out["ext"].append(intern(ext))
+        out["up"].append(i - stack[-1])
+        out["kind"].append(0 if e.is_dir else 1)
+        if e.is_symlink:
+            out["link"][i] = e.link
+        if with_dupes and e.dupe is not None:
+            out["dupe"][i] = e.dupe
+        if e.series is not None:
+            out["series"][i] = e.series
+        st = e.stat
+        size.append(st.st_size if st is not None and not e.is_dir else 0)
+        mtime.append(st.st_mtime_ns // 1_000_000_000 if st is not None else 0)
+        total.append(e.total or 0)
+        files.append(e.files or 0)
+        if with_lines:
+            lines.append(e.lines if e.lines is not None else -1)
+            lang.append(intern(e.language) if e.lines is not None and not e.is_dir else -1)
+            if e.is_dir and e.language:
+                langs[i] = e.language
+        stack.append(i)
+    if with_size:
+        out["size"] = size
+    if with_mtime:
+        out["mtime"] = mtime
+    if with_total:
+        out["total"], out["files"] = total, files
+    if with_lines:
+        out["lines"], out["lang"], out["langs"] = lines, lang, langs
+    tri = {}
+    for t, post in build_index(tree, sort)["tri"].items():
+        tri[t] = [b - a for a, b in zip([0] + post, post)]
+    out["tri"] = tri
+    return out
+
+def write_html(out: Path, tree, cols=(), sort="name", payload="json", roots=None):
+    # テンプレートを __FORMAT_JSON__ / __DATA_JSON__ / __INDEX_JSON__ / __ROOTS_JSON__ で分割して書く。
+    # roots は Tree.merge でまとめたツリーの各ルートのパス（ルート選択を出す）。
+    # json は従来どおり木をそのままストリームし、compact / gzip は列形式を DATA に入れる（INDEX は null）。
+    # 一時ファイルに書いてから置き換えるので、ブラウザが書きかけを読むことはない
+    parts = re.split(r"__([A-Z]+)_JSON__", HTML_TMPL)
+    packed = None
+    if payload != "json":
+        packed = json.dumps(compact_payload(tree, cols, sort), ensure_ascii=False, separators=(",", ":"))
+        if payload == "gzip":
+            packed = json.dumps(base64.b64encode(gzip.compress(packed.encode("utf-8"), mtime=0)).decode("ascii"))
+    tmp = tmp_path(out)
+    try:
+        with open(tmp, "w", encoding="utf-8") as f:
+            w = ScriptWriter(f)
+            for i, part in enumerate(parts):
+                if i % 2 == 0:
+                    f.write(part)
+                elif part == "FORMAT":
+                    f.write(json.dumps(payload))
+                elif part == "ROOTS":
+                    json.dump(roots, w, ensure_ascii=False)
+                elif part == "DATA" and packed is not None:
+                    w.write(packed)
+                elif part == "DATA":
+                    write_json(tree, w, cols=cols, sort=sort)
+                elif part == "INDEX" and packed is not None:
+                    f.write("null")
+                elif part == "INDEX":
+                    json.dump(build_index(tree, sort), w, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp, out)
+    except BaseException:
+        # 失敗（書き込みエラーや Ctrl+C）でも一時ファイルを残さない
+        with contextlib.suppress(OSError):
+            os.unlink(tmp)
+        raise
+
 def main():
     ap = argparse.ArgumentParser(description="Generate a nice HTML tree view (collapsible, searchable, with Next.js role hints).")
-    ap.add_argument("path", nargs="?", default=".", help="root directory (default: .)")
+    add_tree_arguments(ap)
     ap.add_argument("-o", "--output", default="/tmp/tree.html", help="output HTML file (default: /tmp/tree.html)")
-    ap.add_argument("-d", "--max-depth", type=int, help="max depth (default: unlimited)")
-    ap.add_argument("-I", "--ignore", action="append", default=[], help="glob to ignore (repeatable)")
-    ap.add_argument("--show-hidden", action="store_true", help="include dotfiles")
-    ap.add_argument("--dirs-only", action="store_true", help="directories only")
-    ap.add_argument("--files-only", action="store_true", help="files only")
-    ap.add_argument("--limit-per-dir", type=int, default=0, help="limit entries per directory")
-    ap.add_argument("--follow-symlinks", action="store_true", help="descend into symlinked directories")
-    ap.add_argument("--relative", action="store_true", help="root label as '.'")
+    ap.add_argument("--watch", action="store_true", help="keep running and rewrite the HTML when the tree changes")
+    ap.add_argument("--poll-interval", type=float, default=1.0, help="polling interval when inotify is unavailable (seconds); each poll stats every "
+                    "listed dir and its .gitignore, plus every shown file when size/mtime/loc/dupes columns are on")
+    ap.add_argument("--payload", choices=("json", "compact", "gzip"), default="json",
+                    help="embedded data format (compact: string table + integer columns, gzip: compact gzipped as base64)")
+    ap.add_argument("--serve", action="store_true", help="serve the viewer from a local HTTP server that lists directories on demand instead of writing HTML")
+    ap.add_argument("--host", default="127.0.0.1", help="--serve bind address (default: 127.0.0.1)")
+    ap.add_argument("--port", type=int, default=8000, help="--serve port (default: 8000, 0 = any free port)")
+    ap.add_argument("--serve-cache", type=int, default=4096, metavar="DIRS", help="--serve: directory listings kept in the LRU cache")
     args = ap.parse_args()
 
-    data = run_fs_tree_json(
-        root=args.path,
-        depth=args.max_depth,
-        ignores=args.ignore,
-        show_hidden=args.show_hidden,
-        dirs_only=args.dirs_only,
-        files_only=args.files_only,
-        limit_per_dir=args.limit_per_dir,
-        follow_symlinks=args.follow_symlinks,
-        relative=args.relative
-    )
-
-    html = HTML_TMPL.replace("__DATA_JSON__", json.dumps(data, ensure_ascii=False))
-    out = Path(args.output)
-    out.write_text(html, encoding="utf-8")
+    root = resolve_root(args.path)
+    opts = TreeOptions.from_args(args)
+    out = Path(args.output).resolve()
+
+    if args.serve:
+        # ディレクトリの集計（--rollup / --loc の合計 / --dupes / --merkle）は全体を見ないと決まらないので出さない
+        from fs_tree_serve import serve
+        serve(root, opts, shell_html("." if opts.relative else root.name), args.host, args.port, args.serve_cache)
+        return
+    if args.watch:
+        from fs_tree_watch import watch_tree
+        watch_tree(root, opts, lambda tree: write_html(out, tree, opts.columns(), opts.sort, args.payload),
+                   exclude=(str(out), str(tmp_path(out))), poll_interval=args.poll_interval)
+        return
+    matcher = IgnoreMatcher(opts.ignores, opts.show_hidden)
+    stats = open_stats(opts, matcher)
+    cache = open_cache(root, opts)
+    tree = build_tree(root, opts, matcher, cache=cache, stats=stats)
+    close_cache(cache)
+
+    if stats is None:
+        write_html(out, tree, opts.columns(), opts.sort, args.payload)
+    else:
+        with stats.phase("html"):
+            write_html(out, tree, opts.columns(), opts.sort, args.payload)
+    close_stats(stats, opts)
     print(str(out))
 
 if __name__ == "__main__":
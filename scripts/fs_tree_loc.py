@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+# coding: utf-8
+import mmap, os, sys
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+
+from fs_tree import ListingCache, Tree, load_json, save_json
+
+# 拡張子（小文字）→ 言語。ここにない拡張子のテキストは "Text"
+LANGUAGES = {
+    ".py": "Python", ".pyi": "Python",
+    ".js": "JavaScript", ".jsx": "JavaScript", ".mjs": "JavaScript", ".cjs": "JavaScript",
+    ".ts": "TypeScript", ".tsx": "TypeScript", ".mts": "TypeScript", ".cts": "TypeScript",
+    ".json": "JSON", ".md": "Markdown", ".mdx": "Markdown",
+    ".css": "CSS", ".scss": "SCSS", ".sass": "SCSS", ".less": "Less",
+    ".html": "HTML", ".htm": "HTML", ".xml": "XML", ".svg": "SVG",
+    ".yml": "YAML", ".yaml": "YAML", ".toml": "TOML", ".ini": "INI", ".cfg": "INI",
+    ".sh": "Shell", ".bash": "Shell", ".zsh": "Shell",
+    ".c": "C", ".h": "C", ".cc": "C++", ".cpp": "C++", ".cxx": "C++", ".hpp": "C++",
+    ".go": "Go", ".rs": "Rust", ".java": "Java", ".kt": "Kotlin", ".swift": "Swift",
+    ".rb": "Ruby", ".php": "PHP", ".sql": "SQL", ".vue": "Vue", ".svelte": "Svelte",
+    ".txt": "Text", ".csv": "CSV",
+}
+NAMES = {"Makefile": "Makefile", "Dockerfile": "Dockerfile", "CMakeLists.txt": "CMake"}
+
+# 中身を見るまでもなくバイナリと分かる拡張子（開かずに飛ばす）
+BINARY_EXTS = frozenset((
+    ".png", ".jpg", ".jpeg", ".gif", ".webp", ".ico", ".bmp", ".avif", ".pdf",
+    ".zip", ".gz", ".tgz", ".bz2", ".xz", ".7z", ".tar", ".jar", ".whl",
+    ".woff", ".woff2", ".ttf", ".otf", ".eot", ".mp3", ".mp4", ".mov", ".webm", ".wav",
+    ".so", ".dylib", ".dll", ".exe", ".o", ".a", ".pyc", ".class", ".wasm", ".node",
+    ".db", ".sqlite", ".tsbuildinfo",
+))
+
+SNIFF = 8192  # 先頭のこの範囲に NUL があればバイナリ
+MMAP_MIN = 1 << 16  # これより小さいファイルは read 1回の方が速い
+CHUNK = 1 << 20
+PARALLEL_MIN = 256  # これより少ないファイル数ならプロセスを起こさず直列で数える
+
+def language_of(name: str):
+    lang = NAMES.get(name)
+    if lang is None:
+        lang = LANGUAGES.get(os.path.splitext(name)[1].lower(), "Text")
+    return lang
+
+def count_lines(path: str):
+    # 行数（最後の行が改行で終わっていなくても1行と数える）。バイナリや読めないファイルは None
+    try:
+        with open(path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            if size < MMAP_MIN:
+                data = f.read()
+                if b"\0" in data[:SNIFF]:
+                    return None
+                return data.count(b"\n") + (bool(data) and not data.endswith(b"\n"))
+            # 大きいファイルは mmap してページキャッシュから CHUNK ずつ数える（read のバッファを介さない）
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                if mm.find(b"\0", 0, SNIFF) >= 0:
+                    return None
+                n = 0
+                for pos in range(0, len(mm), CHUNK):
+                    n += mm[pos:pos + CHUNK].count(b"\n")
+                return n + (mm[len(mm) - 1] != 0x0A)
+    except (OSError, ValueError):
+        return None
+
+class LocCache:
+    # 行数のディスクキャッシュ。キーはルートからの相対パス、(st_size, st_mtime_ns) が同じなら数え直さない
+    VERSION = 1
+
+    def __init__(self, file: str, root: str):
+        self.file = file
+        self.root = root
+        self.files = {}  # relpath -> [size, mtime_ns, lines or None]
+        self.hits = 0
+        self.misses = 0
+        try:
+            data = load_json(file)
+            if data.get("version") == self.VERSION and data.get("root") == root:
+                self.files = data["files"]
+        except (OSError, ValueError, KeyError):
+            pass
+
+    @staticmethod
+    def default_file(root: str, cache_dir=None):
+        return ListingCache.default_file(root, cache_dir)[:-len(".json")] + ".loc.json"
+
+    def save(self):
+        save_json(self.file, {"version": self.VERSION, "root": self.root, "files": self.files})
+
+def count_tree(tree: Tree, jobs=0, cache=None, prefix=""):
+    # tree の通常ファイル（シンボリックリンクは除く）の行数と言語を tree.lines / tree.lang に入れる。
+    # 数える必要があるファイルだけをプロセスプールに chunk で配る。集計は tree.rollup() が行う。
+    # prefix: cache のキーの前に付ける（--watch が部分木だけ数えるときの、ルートからその部分木までの相対パス）
+    n = len(tree)
+    lines = array("q", [-1]) * n
+    lang = array("i", [-1]) * n
+    paths = tree.paths()
+    kind, flags, size, mtime = tree.kind, tree.flags, tree.size, tree.mtime
+    base = len(os.path.join(tree.path, ""))
+    todo = []
+    for i in range(1, n):
+        name = tree.name_of(i)
+        if kind[i] != Tree.FILE or flags[i] & Tree.F_SYMLINK or i in tree.series or os.path.splitext(name)[1].lower() in BINARY_EXTS:
+            continue
+        if cache is not None and size is not None:
+            rec = cache.files.get(prefix + paths[i][base:])
+            if rec is not None and rec[0] == size[i] and rec[1] == mtime[i]:
+                cache.hits += 1
+                if rec[2] is not None:
+                    lines[i] = rec[2]
+                    lang[i] = tree.intern(language_of(name))
+                continue
+            cache.misses += 1
+        todo.append(i)
+
+    jobs = jobs or os.cpu_count() or 1
+    todo_paths = [paths[i] for i in todo]
+    if jobs > 1 and len(todo) >= PARALLEL_MIN:
+        with ProcessPoolExecutor(jobs) as pool:
+            counts = list(pool.map(count_lines, todo_paths, chunksize=max(1, min(256, len(todo) // (jobs * 4)))))
+    else:
+        counts = [count_lines(p) for p in todo_paths]
+
+    for i, c in zip(todo, counts):
+        if c is not None:
+            lines[i] = c
+            lang[i] = tree.intern(language_of(tree.name_of(i)))
+        if cache is not None and size is not None:
+            cache.files[prefix + paths[i][base:]] = [size[i], mtime[i], c]
+    tree.lines, tree.lang = lines, lang
+    return len(todo)
+
+def loc_pass(tree: Tree, opts, cache=None):
+    # build_tree から呼ぶ: --cache なら行数キャッシュも読み書きする。cache（--watch の常駐キャッシュ）を渡されたらそれを使う
+    if cache is not None:
+        return count_tree(tree, opts.loc_jobs, cache)
+    cache = LocCache(LocCache.default_file(tree.path, opts.cache_dir), tree.path) if opts.cache else None
+    count_tree(tree, opts.loc_jobs, cache)
+    if cache is not None:
+        try:
+            cache.save()
+        except (OSError, UnicodeError) as ex:
+            print(f"Warning: loc cache not saved: {ex}", file=sys.stderr)
+        print(f"loc cache: {cache.hits} hits, {cache.misses} misses ({cache.file})", file=sys.stderr)
@@ -0,0 +1,328 @@
+#!/usr/bin/env python3
+# coding: utf-8
+import gzip, hashlib, json, os, re, sys, threading
+from collections import OrderedDict, namedtuple
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from fs_tree import IgnoreMatcher, IncludeTrie, SeriesGrouper, _restat, close_cache, json_meta, open_cache, scan_dir
+
+GZIP_MIN = 1024  # これより小さい応答は圧縮しない
+
+# ディレクトリを一覧するための文脈（walk が降りながら持ち回すものと同じ）。frames はそのディレクトリ自身の .gitignore まで含む
+Ctx = namedtuple("Ctx", "rel path depth frames state")
+# 1ディレクトリ分の表示内容: 表示するエントリと各 --include 状態、省いた件数
+Listing = namedtuple("Listing", "entries states more")
+
+class LazyTree:
+    # --serve 用: ディレクトリの子を要求されたときに初めて一覧する。LRU に持つのは scandir の生の結果だけで
+    # （ListingCache と同じくディレクトリの mtime で検証する）、除外・--include・連番・件数の上限は要求のたびにかけ直す。
+    # .gitignore（自分や祖先の）を書き換えても、ディレクトリの mtime は変わらないため。同じ理由で、サイズ・mtime の列を
+    # 出すときは LRU から返すたびにエントリを lstat し直す（ListingCache.scan と同じ）
+    def __init__(self, root, opts, max_dirs=4096):
+        self.root = str(root)
+        self.opts = opts
+        self.matcher = IgnoreMatcher(opts.ignores, opts.show_hidden)
+        self.trie = IncludeTrie(opts.includes) if opts.includes else None
+        self.grouper = SeriesGrouper(opts.series_regexes) if opts.series_regexes else None
+        self.cache = open_cache(root, opts)
+        self.scanner = self.cache.scan if self.cache is not None else scan_dir
+        self.cols = tuple(c for c in opts.columns() if c in ("size", "mtime"))
+        self.want_stat = bool(self.cols)
+        self.max_dirs = max_dirs
+        self.lru = OrderedDict()  # path -> (mtime, 並べ替えた生のエントリ)
+        self.lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def _listable(self, depth: int, is_symlink: bool):
+        opts = self.opts
+        if opts.max_depth is not None and depth >= opts.max_depth:
+            return False
+        return opts.follow_symlinks or not is_symlink
+
+    def _child_ctx(self, ctx: Ctx, name: str, state):
+        rel = ctx.rel + "/" + name if ctx.rel else name
+        path = os.path.join(ctx.path, name)
+        return Ctx(rel, path, ctx.depth + 1, self.matcher.descend(ctx.frames, rel, os.path.join(path, ".gitignore")), state)
+
+    def root_ctx(self):
+        frames = self.matcher.descend(self.matcher.root_frames(self.root), "", os.path.join(self.root, ".gitignore"))
+        return Ctx("", self.root, 0, frames, self.trie.start() if self.trie is not None else None)
+
+    def resolve(self, rel: str):
+        # リクエストのパス -> 一覧できるディレクトリの Ctx（除外・範囲外・ルートの外なら None）。
+        # 祖先を1段ずつたどって、walk と同じ除外規則をかける
+        ctx = self.root_ctx()
+        if not rel:
+            return ctx
+        for name in rel.split("/"):
+            if name in ("", ".", ".."):
+                return None
+            relp = ctx.rel + "/" + name if ctx.rel else name
+            path = os.path.join(ctx.path, name)
+            if not os.path.isdir(path) or self.opts.files_only or self.matcher.ignored(ctx.frames, name, relp, True):
+                return None
+            if not self._listable(ctx.depth + 1, os.path.islink(path)):
+                return None
+            state = None
+            if ctx.state is not None:
+                state = self.trie.step(ctx.state, name, True)
+                if state == ():
+                    return None
+            ctx = self._child_ctx(ctx, name, state)
+        return ctx
+
+    def _raw(self, path: str, restat=True):
+        # restat: サイズ・mtime を使わない呼び出し（検索や --include の先読み）は False で lstat を省く
+        mtime = os.stat(path).st_mtime_ns
+        with self.lock:
+            cached = self.lru.get(path)
+            hit = cached is not None and cached[0] == mtime
+            if hit:
+                self.lru.move_to_end(path)
+                self.hits += 1
+            else:
+                self.misses += 1
+        if hit:
+            return [_restat(e) for e in cached[1]] if restat and self.want_stat else cached[1]
+        entries = sorted(self.scanner(path, self.want_stat, None), key=lambda e: (e.is_file, e.name.lower()))
+        with self.lock:
+            self.lru[path] = (mtime, entries)
+            self.lru.move_to_end(path)
+            while len(self.lru) > self.max_dirs:
+                self.lru.popitem(last=False)
+        return entries
+
+    def listing(self, ctx: Ctx, restat=True):
+        # list_dir の scan() と同じ並び・絞り込みで1ディレクトリ分を作る
+        if not self._listable(ctx.depth, False):
+            return Listing([], [], 0)
+        opts, matcher, trie = self.opts, self.matcher, self.trie
+        entries = self._raw(ctx.path, restat)
+        prefix = ctx.rel + "/" if ctx.rel else ""
+        show, states = [], []
+        for e in entries:
+            if matcher.ignored(ctx.frames, e.name, prefix + e.name, e.is_dir):
+                continue
+            if (opts.dirs_only and not e.is_dir) or (opts.files_only and not e.is_file):
+                continue
+            sub = None
+            if ctx.state is not None:
+                sub = trie.step(ctx.state, e.name, e.is_dir)
+                if sub == () or (sub and not self._has_match(ctx, e, sub)):
+                    continue
+            show.append(e)
+            states.append(sub)
+        if self.grouper is not None:
+            show, keep = self.grouper.group(show, self.want_stat)
+            states = [states[k] for k in keep]
+        more = 0
+        if opts.limit_per_dir and len(show) > opts.limit_per_dir:
+            more = len(show) - opts.limit_per_dir
+            del show[opts.limit_per_dir:]
+            del states[opts.limit_per_dir:]
+        return Listing(show, states, more)
+
+    def children(self, ctx: Ctx):
+        # /api/children の応答本体と ETag（本体のハッシュなので、.gitignore の変更で一覧が変われば ETag も変わる）
+        res = self.listing(ctx)
+        nodes = []
+        for e in res.entries:
+            node = {"name": e.name, "type": "dir" if e.is_dir else "file"}
+            if e.is_symlink:
+                node["symlink_to"] = e.link
+            node.update(json_meta(e, self.cols))
+            nodes.append(node)
+        body = json.dumps({"path": ctx.rel, "children": nodes, "more": res.more}, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        return body, '"' + hashlib.blake2b(body, digest_size=8).hexdigest() + '"'
+
+    def _has_match(self, ctx: Ctx, e, state):
+        # --include の候補ディレクトリ e の配下に実際のマッチがあるか（list_dir の has_match と同じく最初の1件で打ち切る）
+        if not (e.is_dir and self._listable(ctx.depth + 1, e.is_symlink)):
+            return False
+        ctx = self._child_ctx(ctx, e.name, state)
+        prefix = ctx.rel + "/"
+        try:
+            entries = self._raw(ctx.path, False)
+        except OSError:
+            return False
+        for c in entries:
+            if self.matcher.ignored(ctx.frames, c.name, prefix + c.name, c.is_dir):
+                continue
+            if (self.opts.dirs_only and not c.is_dir) or (self.opts.files_only and not c.is_file):
+                continue
+            sub = self.trie.step(ctx.state, c.name, c.is_dir)
+            if sub is None or (sub and self._has_match(ctx, c, sub)):
+                return True
+        return False
+
+    def search(self, q: str, limit=1000):
+        # ビューアーの検索と同じ規則（'/' を含めばパスのグロブ、なければ名前の部分一致で * 区切り）で、
+        # 一覧を先行順にたどる。たどった scandir の結果は LRU に残るので、2回目以降は各ディレクトリの stat だけで済む
+        q = q.strip().lower()
+        if q.endswith("/"):
+            q += "**"
+        if "/" in q:
+            rx = glob_regex(q)
+            test = lambda rel, name: rx.search(rel) is not None
+        else:
+            frags = [f for f in q.split("*") if f]
+            test = lambda rel, name: frag_match(frags, name)
+        hits = []
+        stack = [self.root_ctx()]
+        while stack:
+            ctx = stack.pop()
+            try:
+                res = self.listing(ctx, False)
+            except OSError:
+                continue
+            sub = []
+            for e, state in zip(res.entries, res.states):
+                rel = ctx.rel + "/" + e.name if ctx.rel else e.name
+                if test(rel.lower(), e.name.lower()):
+                    if len(hits) >= limit:
+                        return hits, True
+                    hits.append({"path": rel, "type": "dir" if e.is_dir else "file"})
+                if e.is_dir and self._listable(ctx.depth + 1, e.is_symlink):
+                    sub.append(self._child_ctx(ctx, e.name, state))
+            stack += reversed(sub)
+        return hits, False
+
+    def meta(self, rel: str):
+        # 1エントリの最新の属性（lstat し直す）。--loc ならファイルの行数も数える
+        parent, _, name = rel.rpartition("/")
+        ctx = self.resolve(parent)
+        if ctx is None or not name:
+            return None
+        e = next((e for e in self.listing(ctx, False).entries if e.name == name), None)
+        if e is None:
+            return None
+        out = {"name": e.name, "path": rel, "type": "dir" if e.is_dir else "file"}
+        if e.is_symlink:
+            out["symlink_to"] = e.link
+        if e.series is not None:
+            out.update(json_meta(e, ()))
+            return out
+        try:
+            st = os.lstat(e.path)
+        except OSError:
+            return out
+        if not e.is_dir:
+            out["size"] = st.st_size
+        out["mtime"] = st.st_mtime_ns // 1_000_000_000
+        if self.opts.loc and e.is_file and not e.is_symlink:
+            from fs_tree_loc import count_lines, language_of
+            n = count_lines(e.path)
+            if n is not None:
+                out["lines"], out["language"] = n, language_of(e.name)
+        return out
+
+def glob_regex(q: str):
+    # ビューアーの globRegex と同じ: * はセグメント内、** は階層をまたぐ、? は1文字
+    out, i = [], 0
+    while i < len(q):
+        c = q[i]
+        if c == "*" and q[i + 1:i + 3] == "*/":
+            out.append("(.*/)?")
+            i += 3
+            continue
+        if c == "*" and q[i + 1:i + 2] == "*":
+            out.append(".*")
+            i += 2
+            continue
+        out.append("[^/]*" if c == "*" else "[^/]" if c == "?" else re.escape(c))
+        i += 1
+    return re.compile("(^|/)" + "".join(out) + "$")
+
+def frag_match(frags, text: str):
+    pos = 0
+    for f in frags:
+        i = text.find(f, pos)
+        if i < 0:
+            return False
+        pos = i + len(f)
+    return True
+
+def make_handler(tree: LazyTree, shell: bytes):
+    shell_gz = gzip.compress(shell, 9, mtime=0)
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, fmt, *args):
+            pass
+
+        def send_body(self, body: bytes, gz=None, ctype="application/json; charset=utf-8", status=200, etag=None):
+            # gz は body を圧縮済みのもの（なければ大きい応答だけここで圧縮する）
+            if "gzip" in self.headers.get("Accept-Encoding", ""):
+                if gz is None and len(body) >= GZIP_MIN:
+                    gz = gzip.compress(body, 6, mtime=0)
+            else:
+                gz = None
+            self.send_response(status)
+            self.send_header("Content-Type", ctype)
+            self.send_header("Cache-Control", "no-cache")
+            if etag is not None:
+                self.send_header("ETag", etag)
+            if gz is not None:
+                self.send_header("Content-Encoding", "gzip")
+                body = gz
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def send_json(self, obj, status=200):
+            self.send_body(json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8"), status=status)
+
+        def do_GET(self):
+            url = urlsplit(self.path)
+            qs = {k: v[-1] for k, v in parse_qs(url.query).items()}
+            rel = qs.get("path", "").strip("/")
+            try:
+                if url.path in ("/", "/index.html"):
+                    self.send_body(shell, shell_gz, "text/html; charset=utf-8")
+                elif url.path == "/api/children":
+                    ctx = tree.resolve(rel)
+                    if ctx is None:
+                        return self.send_json({"error": f"not a listed directory: {rel}"}, 404)
+                    body, etag = tree.children(ctx)
+                    if self.headers.get("If-None-Match") == etag:
+                        self.send_response(304)
+                        self.send_header("ETag", etag)
+                        self.send_header("Content-Length", "0")
+                        self.end_headers()
+                        return
+                    self.send_body(body, etag=etag)
+                elif url.path == "/api/search":
+                    try:
+                        limit = int(qs.get("limit", 1000))
+                    except ValueError:
+                        return self.send_json({"error": f"bad limit: {qs['limit']}"}, 400)
+                    hits, truncated = tree.search(qs.get("q", ""), limit)
+                    self.send_json({"hits": hits, "truncated": truncated})
+                elif url.path == "/api/meta":
+                    meta = tree.meta(rel)
+                    if meta is None:
+                        return self.send_json({"error": f"not found: {rel}"}, 404)
+                    self.send_json(meta)
+                else:
+                    self.send_json({"error": "not found"}, 404)
+            except (OSError, ValueError) as ex:
+                self.send_json({"error": str(ex)}, 500)
+
+    return Handler
+
+def serve(root, opts, shell: str, host="127.0.0.1", port=8000, max_dirs=4096):
+    # ビューアーの外枠と JSON の API を返すローカルサーバー（ツリー全体は一度も walk しない）
+    tree = LazyTree(root, opts, max_dirs)
+    server = ThreadingHTTPServer((host, port), make_handler(tree, shell.encode("utf-8")))
+    server.daemon_threads = True
+    print(f"serving {root} at http://{host}:{server.server_address[1]}/", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        close_cache(tree.cache)
+        print(f"listings: {tree.hits} hits, {tree.misses} misses, {len(tree.lru)} cached", file=sys.stderr)
@@ -0,0 +1,340 @@
+#!/usr/bin/env python3
+# coding: utf-8
+import ctypes, ctypes.util, os, select, struct, sys, time
+
+from fs_tree import Entry, IgnoreMatcher, Tree, build_tree, scan_dir, walk
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+_EVENT = struct.Struct("iIII")
+
+# 取りこぼし（キューあふれ等）で全ディレクトリを無効化する印
+ALL = "*"
+
+class MemoryListingCache:
+    # ListingCache と同じ scan() を持つメモリ常駐版。invalidate されたディレクトリだけ scandir し直す
+    def __init__(self):
+        self.listings = {}
+        self.visited = set()
+
+    def scan(self, path: str, want_stat=False, stat_pool=None):
+        self.visited.add(path)
+        entries = self.listings.get(path)
+        if entries is None:
+            entries = self.listings[path] = scan_dir(path, want_stat, stat_pool)
+        return entries
+
+    def invalidate(self, paths):
+        if ALL in paths:
+            self.listings.clear()
+            return
+        for p in paths:
+            self.listings.pop(p, None)
+
+    def begin(self):
+        self.visited = set()
+
+    def prune(self):
+        # 今回の walk で辿らなかった（消えた・除外された）ディレクトリの一覧を捨てる
+        for p in [p for p in self.listings if p not in self.visited]:
+            del self.listings[p]
+
+class MemoryLocCache:
+    # LocCache と同じ files / hits / misses を持つメモリ常駐版（ファイルには保存しない）
+    def __init__(self):
+        self.files = {}  # relpath -> [size, mtime_ns, lines or None]
+        self.hits = 0
+        self.misses = 0
+
+class InotifyWatcher:
+    MASK = (IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO | IN_CLOSE_WRITE
+            | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+
+    def __init__(self, exclude=()):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        libc.inotify_add_watch.argtypes = (ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32)
+        fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        self._libc = libc
+        self.fd = fd
+        self.exclude = set(exclude)
+        self.paths = {}  # wd -> dir path
+        self.wds = {}  # dir path -> wd
+
+    def sync(self, dirs, files=()):
+        # ファイルの書き込みは親ディレクトリの IN_CLOSE_WRITE で分かるので files は使わない
+        for path in dirs:
+            if path in self.wds:
+                continue
+            wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), self.MASK)
+            if wd >= 0:
+                self.paths[wd] = path
+                self.wds[path] = wd
+        for path in [p for p in self.wds if p not in dirs]:
+            self._libc.inotify_rm_watch(self.fd, self.wds.pop(path))
+
+    def wait(self, timeout=None):
+        changed = set()
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return changed
+        while True:
+            try:
+                buf = os.read(self.fd, 65536)
+            except BlockingIOError:
+                break
+            pos = 0
+            while pos < len(buf):
+                wd, mask, _, size = _EVENT.unpack_from(buf, pos)
+                name = buf[pos + _EVENT.size:pos + _EVENT.size + size].rstrip(b"\0")
+                pos += _EVENT.size + size
+                if mask & IN_Q_OVERFLOW:
+                    changed.add(ALL)
+                    continue
+                path = self.paths.get(wd)
+                if path is None:
+                    continue
+                if mask & IN_IGNORED:
+                    del self.paths[wd]
+                    self.wds.pop(path, None)
+                    continue
+                if name and os.path.join(path, os.fsdecode(name)) in self.exclude:
+                    continue
+                changed.add(path)
+        return changed
+
+    def close(self):
+        os.close(self.fd)
+
+class PollWatcher:
+    # inotify が使えない環境向け。既知ディレクトリと各ディレクトリの .gitignore、渡されたファイル（stat の列を出すときの
+    # 表示中のファイル）の st_mtime_ns を定期的に見比べる。ディレクトリの mtime はエントリの追加・削除・改名でしか
+    # 変わらないので、.gitignore の編集やファイルの書き込みはそれぞれの mtime で見る。変わったものは親ディレクトリとして返す
+    def __init__(self, exclude=(), interval=1.0):
+        self.interval = interval
+        self.exclude = set(exclude)
+        self.exclude_dirs = {os.path.dirname(p) for p in exclude}
+        self.dirs = set()
+        self.mtimes = {}
+
+    def _mtime(self, path):
+        try:
+            return os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+
+    def sync(self, dirs, files=()):
+        self.dirs = set(dirs)
+        paths = list(self.dirs)
+        paths += [os.path.join(d, ".gitignore") for d in self.dirs]
+        paths += [p for p in files if p not in self.exclude]
+        self.mtimes = {p: self.mtimes[p] if p in self.mtimes else self._mtime(p) for p in paths}
+        # 出力ファイルの書き込みで変わった mtime は変更として扱わない
+        for p in self.exclude_dirs & self.mtimes.keys():
+            self.mtimes[p] = self._mtime(p)
+
+    def wait(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            delay = self.interval if deadline is None else min(self.interval, max(0.0, deadline - time.monotonic()))
+            time.sleep(delay)
+            changed = set()
+            for p, old in self.mtimes.items():
+                cur = self._mtime(p)
+                if cur != old:
+                    self.mtimes[p] = cur
+                    changed.add(p if p in self.dirs else os.path.dirname(p))
+            if changed or (deadline is not None and time.monotonic() >= deadline):
+                return changed
+
+    def close(self):
+        pass
+
+def make_watcher(exclude=(), poll_interval=1.0):
+    if sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher(exclude)
+        except (OSError, AttributeError):
+            pass
+    return PollWatcher(exclude, poll_interval)
+
+def debounced(watcher, quiet=0.3, max_delay=2.0):
+    # 変更が quiet 秒途切れるまで（最長 max_delay 秒）まとめてから1回分として返す
+    while True:
+        changed = watcher.wait(None)
+        if not changed:
+            continue
+        start = time.monotonic()
+        while True:
+            remaining = max_delay - (time.monotonic() - start)
+            if remaining <= 0:
+                break
+            more = watcher.wait(min(quiet, remaining))
+            if not more:
+                break
+            changed |= more
+        yield changed
+
+class ResidentTree:
+    # --watch 用: Tree と、一覧したディレクトリごとの walk の文脈（深さ・親から受け取った frames・--include 状態）を常駐させる。
+    # 変更のあったディレクトリだけ一覧し直して部分木を作り、文脈の変わらない子ディレクトリの配下は前の Tree から
+    # 引き継いで Tree.splice で差し込む（除外の判定も .gitignore の読み直しも、一覧し直したディレクトリの分だけ）
+    def __init__(self, root, opts, matcher, cache):
+        self.root = root
+        self.opts = opts
+        self.matcher = matcher
+        self.cache = cache
+        self.loc = MemoryLocCache() if opts.loc else None
+        self.hashes = {} if opts.dupes else None
+        self.dirs = {}  # path -> (深さ, frames, --include 状態)
+        self.tree = None
+
+    @property
+    def watched(self):
+        # --include の候補は表示しないディレクトリまで先読みするので、その分も見張る
+        return self.cache.visited if self.opts.includes else self.dirs.keys()
+
+    def build(self):
+        def record(cur, depth, frames, state):
+            self.dirs[cur.path] = (depth, frames, state)
+            return True
+
+        self.dirs = {}
+        self.cache.begin()
+        self.tree = build_tree(self.root, self.opts, self.matcher, cache=self.cache, loc_cache=self.loc, hash_cache=self.hashes, on_dir=record)
+        self.cache.prune()
+        self._prune_files(force=True)
+        return self.tree
+
+    def update(self, changed):
+        # 浅いディレクトリから差し替える（一覧し直した部分木の中で変わったものは済んでいる）。取りこぼし（ALL）と
+        # --include（深い所の変更で候補の祖先が出たり消えたりする）は全体を作り直す
+        self.cache.invalidate(changed)
+        if ALL in changed or self.opts.includes:
+            return self.build()
+        fresh = set()
+        for path in sorted(changed, key=lambda p: p.count(os.sep)):
+            # 消えたディレクトリは親を一覧し直したときに外れる
+            if path in self.dirs and path not in fresh and os.path.isdir(path):
+                self._rescan(path, changed, fresh)
+        opts, tree = self.opts, self.tree
+        if opts.dupes:
+            from fs_tree_dupes import find_dupes
+            find_dupes(tree, opts.dupes_jobs, self.hashes)
+        if opts.needs_tree:
+            tree.rollup()
+        if opts.merkle:
+            tree.merkle(opts.size, opts.mtime)
+        self._prune_files()
+        return tree
+
+    def _index(self, path: str):
+        # path のノード番号（ルートから名前で子をたどる）
+        i = 0
+        rel = os.path.relpath(path, self.root)
+        for name in (rel.split(os.sep) if rel != "." else ()):
+            i = self.tree.child(i, name)
+            if i is None:
+                return None
+        return i
+
+    def _rescan(self, path: str, changed, fresh):
+        opts, tree = self.opts, self.tree
+        i = self._index(path)
+        if i is None:
+            return
+        depth, frames, state = self.dirs[path]
+        old = {}  # 子ディレクトリの名前 -> 前のノード
+        j = i + 1
+        while True:
+            try:
+                j = tree.parent.index(i, j)
+            except ValueError:
+                break
+            if tree.kind[j] == Tree.DIR:
+                old[tree.name_of(j)] = j
+            j += 1
+        kept = {}  # 引き継ぐ子ディレクトリ: path -> 前のノード
+
+        def visit(cur, d, fr, st):
+            if d == depth + 1 and cur.path not in changed and cur.name in old and self.dirs.get(cur.path) == (d, fr, st):
+                kept[cur.path] = old[cur.name]
+                return False
+            fresh.add(cur.path)
+            self.dirs[cur.path] = (d, fr, st)
+            return True
+
+        start = (Entry(os.path.basename(path), path, True, False, False, None, None), depth, frames, state)
+        items = ((k, e, d - depth + 1, last, more) for k, e, d, last, more in
+                 walk(self.root, opts, self.matcher, cache=self.cache, start=start, on_dir=visit))
+        sub = Tree.from_items(tree.name_of(i), items, path, with_stat=opts.needs_stat)
+        kept_names = {os.path.basename(p): o for p, o in kept.items()}
+        keep = {k: kept_names[sub.name_of(k)] for k in range(1, len(sub))
+                if sub.kind[k] == Tree.DIR and sub.parent[k] == 0 and sub.name_of(k) in kept_names}
+        if self.loc is not None:
+            from fs_tree_loc import count_tree
+            rel = os.path.relpath(path, self.root)
+            count_tree(sub, opts.loc_jobs, self.loc, "" if rel == "." else rel + os.sep)
+        tree.splice(i, sub, keep)
+        # 消えた（または作り直した）配下の文脈と一覧を捨てる
+        base = os.path.join(path, "")
+        for p in [p for p in self.dirs if p.startswith(base) and p not in fresh]:
+            if os.path.join(path, p[len(base):].split(os.sep, 1)[0]) not in kept:
+                del self.dirs[p]
+                self.cache.listings.pop(p, None)
+
+    def _prune_files(self, force=False):
+        # 消えた・除外されたファイルの行数とハッシュを捨てる（全体をなめるので、溜まってきたときだけ）
+        loc, hashes, tree = self.loc, self.hashes, self.tree
+        held = (len(loc.files) if loc is not None else 0) + (len(hashes) if hashes is not None else 0)
+        if not held or (not force and held < 2 * len(tree)):
+            return
+        paths = set(tree.paths())
+        prefix = os.path.join(tree.path, "")
+        if loc is not None:
+            loc.files = {k: v for k, v in loc.files.items() if prefix + k in paths}
+        if hashes is not None:
+            for p in [p for p in hashes if p not in paths]:
+                del hashes[p]
+
+def watch_tree(root, opts, render, exclude=(), quiet=0.3, poll_interval=1.0):
+    # ツリーを一度だけ構築して常駐させ、変更のあったディレクトリの部分木だけ作り直して差し込み、render する（render 自体は全体を書く）。
+    # 行数（--loc）とハッシュ（--dupes）も (size, mtime) で検証して持ち越すので、数え直すのは変わったファイルだけ
+    resident = ResidentTree(root, opts, IgnoreMatcher(opts.ignores, opts.show_hidden), MemoryListingCache())
+    watcher = make_watcher(exclude, poll_interval)
+
+    def publish(tree):
+        render(tree)
+        files = ()
+        if opts.needs_stat and isinstance(watcher, PollWatcher):
+            paths = tree.paths()
+            files = [paths[i] for i in range(1, len(tree)) if tree.kind[i] == Tree.FILE and not tree.flags[i] & Tree.F_SYMLINK]
+        watcher.sync(resident.watched, files)
+
+    tree = resident.build()
+    publish(tree)
+    print(f"watching {len(resident.watched)} dirs with {type(watcher).__name__} ({len(tree)} entries)", file=sys.stderr)
+    try:
+        for changed in debounced(watcher, quiet):
+            t0 = time.perf_counter()
+            tree = resident.update(changed)
+            t1 = time.perf_counter()
+            publish(tree)
+            ms = (t1 - t0) * 1000, (time.perf_counter() - t1) * 1000
+            print(f"updated: {len(changed)} dirs rescanned, {len(tree)} entries, {ms[0]:.0f} ms (+{ms[1]:.0f} ms render)", file=sys.stderr)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()